@@ -0,0 +1,151 @@
+"""Admission control of the expensive endpoints.
+
+Every path in ADMISSION_LIMITS runs at most ``concurrency`` requests at once in this process, and up to
+``queue`` more wait for a slot, in arrival order, for at most ADMISSION_QUEUE_TIMEOUT seconds. A request
+finding the queue full gets a 429 and one that waited too long a 503, both with a Retry-After estimated
+from how long the slots have been held lately, so a burst of exports is shed instead of exhausting the
+database pool and the memory every other endpoint needs.
+
+A slot is held until the response body is fully sent, which covers streamed and file responses. The
+counts are served on /admission and as the syh_admission_* metrics.
+"""
+import asyncio
+import collections
+import json
+import math
+import time
+
+from . import metrics
+from .config import ADMISSION_LIMITS, ADMISSION_QUEUE_TIMEOUT
+
+
+def parse_limits(spec: str):
+    """``{path: (concurrency, queue)}`` from ``path=concurrency:queue`` items separated by commas."""
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        path, _, counts = item.strip().partition('=')
+        concurrency, _, queue = counts.partition(':')
+        limits[path.strip()] = (int(concurrency), int(queue or 0))
+    return limits
+
+
+class Saturated(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Limit:
+    def __init__(self, concurrency: int, queue: int, timeout: float):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters = collections.deque()
+        # moving average of how long a slot is held, None until one has been released
+        self._seconds = None
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a request arriving now, at least 1."""
+        seconds = self._seconds if self._seconds is not None else self.timeout
+        return max(1, math.ceil(seconds * (self.queued + 1) / max(self.concurrency, 1)))
+
+    async def acquire(self):
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            return
+        if self.queued >= self.queue:
+            raise Saturated(429, "Too many requests waiting for this endpoint", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            raise Saturated(503, "Timed out waiting for this endpoint", self.retry_after())
+        except BaseException:
+            # cancelled (the client went away) right after release() handed the slot over
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, seconds: float = None):
+        """Free a slot, handing it over to the first request still waiting."""
+        if seconds is not None:
+            self._seconds = seconds if self._seconds is None else 0.8 * self._seconds + 0.2 * seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def status(self):
+        return {'in_flight': self.in_flight, 'queued': self.queued, 'concurrency': self.concurrency,
+                'queue': self.queue}
+
+
+limits = {path: Limit(concurrency, queue, ADMISSION_QUEUE_TIMEOUT)
+          for path, (concurrency, queue) in parse_limits(ADMISSION_LIMITS).items()}
+
+metrics.Gauge('syh_admission_in_flight', "Requests running per limited endpoint", ('endpoint',),
+              function=lambda endpoint: limits[endpoint].in_flight, values=[(path,) for path in limits])
+metrics.Gauge('syh_admission_queued', "Requests waiting for a slot per limited endpoint", ('endpoint',),
+              function=lambda endpoint: limits[endpoint].queued, values=[(path,) for path in limits])
+rejected = metrics.Counter('syh_admission_rejected_total', "Requests turned away by admission control",
+                           ('endpoint', 'status'))
+
+
+def status():
+    return {path: limit.status() for path, limit in limits.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware holding a slot of the limit of the request path while the request is served."""
+
+    def __init__(self, app, paths: dict = None):
+        self.app = app
+        self.paths = limits if paths is None else paths
+
+    def _limit(self, scope):
+        path = scope['path']
+        root = scope.get('root_path', '')
+        if root and path.startswith(root):
+            path = path[len(root):]
+        return path, self.paths.get(path)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        path, limit = self._limit(scope)
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            await limit.acquire()
+        except Saturated as e:
+            rejected.inc(endpoint=path, status=e.status_code)
+            body = json.dumps({'detail': e.detail}).encode('utf-8')
+            await send({'type': 'http.response.start', 'status': e.status_code,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(body)).encode('latin-1')),
+                                    (b'retry-after', str(e.retry_after).encode('latin-1'))]})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release(time.perf_counter() - start)
@@ -1,9 +1,12 @@
 from typing import List
 
 import datetime
+import json
+import uuid
 
 from fastapi import Depends, FastAPI, HTTPException, Header, status, Query
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
@@ -11,18 +14,18 @@ from jose import JWTError, jwt
 
 
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from . import crud, models, schemas
-from .database import SessionLocal, engine, Base
+from . import admission, crud, exports, geo, jobs, metrics, models, responses, schemas, writers
+from .principals import principals
+from .database import AsyncSessionLocal, CEDBContextManager, SessionLocal, async_engine
+from starlette.concurrency import run_in_threadpool
 
-from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, CREATE_SCHEMA_ON_STARTUP, ENTITIES_PAGE_MAX
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# TODO use alembic
-Base.metadata.create_all(bind=engine)
-
 api_description = '''
 API Data Show Your Heart
 '''
@@ -56,6 +59,9 @@ tags_metadata = [
 
 app = FastAPI(openapi_tags=tags_metadata, **api_metainfo)
 
+# expensive endpoints are limited innermost, so the rejections still get CORS headers and are measured
+app.add_middleware(admission.AdmissionMiddleware)
+
 # allow for CORS
 origins = ["*"]
 app.add_middleware(
@@ -64,7 +70,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After", "X-High-Water-Mark", "X-Next-Cursor"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 # Dependency
@@ -76,7 +84,36 @@ def get_db():
         db.close()
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def stream_query(fetch, fmt: str, filename: str):
+    """Stream the rows ``fetch(db)`` returns, as columns and rows, in ``fmt``.
+
+    The generator owns its session so it outlives the request scope.
+    """
+    try:
+        writers.check_format(fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def content():
+        with CEDBContextManager() as db:
+            columns, rows = fetch(db)
+            yield from writers.encode(fmt, columns, rows)
+
+    headers = {'Content-Disposition': 'attachment; filename="' + filename + '.' + fmt + '"'}
+    return StreamingResponse(content(), media_type=writers.STREAM_FORMATS[fmt], headers=headers)
+
+
+def dumps(content):
+    """Compact JSON text of ``content``, the async endpoints call it on a worker thread."""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -90,9 +127,16 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
+    user = principals.get(token)
+    if user is not None and user.username == token_data.username:
+        return user
+    # only open a session when the principal is not cached
+    with CEDBContextManager() as db:
+        db_user = crud.get_user_by_username(db, username=token_data.username)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.ApiUser.from_orm(db_user)
+    principals.put(token, user)
     return user
 
 
@@ -102,15 +146,26 @@ def get_current_active_user(current_user: schemas.ApiUser = Depends(get_current_
     return current_user
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/admission", include_in_schema=False)
+def get_admission():
+    """Requests running and waiting for every endpoint under admission control."""
+    return admission.status()
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url='/apidata/docs')
 
 
 @app.post("/token", tags=["auth"], response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
-                           db: Session = Depends(get_db)):
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db: AsyncSession = Depends(get_async_db)):
+    user = await crud.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -135,18 +190,65 @@ def create_user(user: schemas.ApiUserCreate, db: Session = Depends(get_db)
     return crud.create_user(db=db, user=user)
 
 
+@app.post("/users/{username}/deactivate", tags=["users"], response_model=schemas.ApiUser)
+def deactivate_user(username: str, db: Session = Depends(get_db)
+                    , current_user: schemas.ApiUser = Depends(get_current_active_user)):
+    db_user = crud.set_user_active(db, username=username, is_active=False)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
 @app.get("/answers", tags=["Data"])
-def answers(
+async def answers(
         organization: str,
         campaign: str,
         method: str,
         project: str = None,
         language: str = None,
         direct_indicators: bool = True,
+        if_none_match: str = Header(None),
+        accept_encoding: str = Header(None),
+        # current_user: schemas.ApiUser = Depends(get_current_active_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    response = await crud.get_answers_async(db, organization=organization, project=project, method=method,
+                                            campaign=campaign, language=language,
+                                            direct_indicators=direct_indicators, if_none_match=if_none_match)
+    return await responses.compress_async(response, accept_encoding)
+
+
+@app.get("/answers/bulk", tags=["Data"])
+def answers_bulk(
+        campaign: str,
+        method: str,
+        organization: List[str] = Query(None),
+        network: List[str] = Query(None, description="Network ids, repeat it to combine several networks"),
+        project: str = None,
+        language: str = None,
+        direct_indicators: bool = True,
         # current_user: schemas.ApiUser = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
 ):
-    return crud.get_answers(db, organization=organization, project=project, method=method, campaign=campaign, language=language, direct_indicators=direct_indicators)
+    """One JSON document per organization, as newline delimited JSON, from a single query."""
+    if not organization and not network:
+        raise HTTPException(status_code=400, detail="organization or network is required")
+    # checked before the stream starts, its errors could only truncate a 200 afterwards
+    crud.language_suffix(language)
+    for id_organization in organization or ():
+        try:
+            uuid.UUID(id_organization)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid organization id: {id_organization}")
+
+    def content():
+        with CEDBContextManager() as db:
+            for id_organization, document in crud.iter_answers(
+                    db, campaign=campaign, method=method, organizations=organization, network=network,
+                    project=project, language=language, direct_indicators=direct_indicators):
+                line = {'id_organization': id_organization, 'answers': document}
+                yield (json.dumps(line, ensure_ascii=False, default=writers.json_default) + '\n').encode('utf-8')
+
+    return StreamingResponse(content(), media_type=writers.STREAM_FORMATS['ndjson'])
 
 
 @app.get("/review-answers", tags=["Data"])
@@ -155,18 +257,23 @@ def answers(
         method: str,
         organization: str = None,
         project: str = None,
-        network: str = None,
+        network: List[str] = Query(None, description="Network ids, repeat it to combine several networks"),
         language: str = None,
+        format: str = None,
         # current_user: schemas.ApiUser = Depends(get_current_active_user),
         db: Session = Depends(get_db)
 ):
-    file = crud.get_review_answers(db, campaign=campaign, method=method, organization=organization, project=project,
-                                   language=language, network=network)
-    headers = {'Content-Disposition': 'attachment; filename="' + file + '"'}
-    return FileResponse(
-        crud.get_review_answers(db, campaign=campaign, method=method, organization=organization, project=project,
-                                language=language, network=network),
-        headers=headers)
+    # checked before a stream starts, its errors could only truncate a 200 afterwards
+    crud.language_suffix(language)
+    if format is not None:
+        def fetch(db):
+            return crud.iter_review_answers(db, campaign=campaign, method=method, organization=organization,
+                                            project=project, language=language, network=network)
+        return stream_query(fetch, format, f"review_{campaign}-{method}")
+    path, filename = exports.build(db, 'review-answers', campaign=campaign, method=method, organization=organization,
+                                   project=project, language=language, network=network)
+    headers = {'Content-Disposition': 'attachment; filename="' + filename + '"'}
+    return FileResponse(path, headers=headers)
 
 
 @app.get("/export-answers", tags=["Data"])
@@ -175,18 +282,63 @@ def answers(
         method: str,
         organization: str = None,
         project: str = None,
-        network: str = None,
+        network: List[str] = Query(None, description="Network ids, repeat it to combine several networks"),
         language: str = None,
+        format: str = None,
+        since: datetime.datetime = Query(None, description="Only the surveys updated after this high water mark, as newline delimited JSON"),
         # current_user: schemas.ApiUser = Depends(get_current_active_user),
         db: Session = Depends(get_db)
 ):
-    file = crud.get_export_answers(db, campaign=campaign, method=method, organization=organization, project=project,
-                                   language=language, network=network)
-    headers = {'Content-Disposition': 'attachment; filename="' + file + '"'}
-    return FileResponse(
-        crud.get_export_answers(db, campaign=campaign, method=method, organization=organization, project=project,
-                                language=language, network=network),
-        headers=headers)
+    # checked before a stream starts, its errors could only truncate a 200 afterwards
+    crud.language_suffix(language)
+    if since is not None:
+        return export_answers_delta(db, campaign=campaign, method=method, organization=organization,
+                                    project=project, network=network, language=language, since=since,
+                                    fmt=format)
+    if format is not None:
+        def fetch(db):
+            return crud.iter_export_answers(db, campaign=campaign, method=method, organization=organization,
+                                            project=project, language=language, network=network)
+        return stream_query(fetch, format, f"export_{campaign}-{method}")
+    path, filename = exports.build(db, 'export-answers', campaign=campaign, method=method, organization=organization,
+                                   project=project, language=language, network=network)
+    headers = {'Content-Disposition': 'attachment; filename="' + filename + '"'}
+    return FileResponse(path, headers=headers)
+
+
+def export_answers_delta(db, campaign: str, method: str, since: datetime.datetime, fmt: str = None, **scope):
+    """Delta of /export-answers, the high water mark is read before any row so nothing newer slips in."""
+    if fmt is not None and fmt != 'ndjson':
+        raise HTTPException(status_code=400, detail="Deltas are only available as ndjson")
+    language = scope.pop('language')
+    until = crud.get_export_answers_high_water_mark(db, campaign=campaign, method=method, **scope)
+
+    def content():
+        with CEDBContextManager() as db:
+            for record in crud.iter_export_answers_delta(db, campaign=campaign, method=method, since=since,
+                                                         until=until, language=language, **scope):
+                yield (json.dumps(record, ensure_ascii=False, default=writers.json_default) + '\n').encode('utf-8')
+
+    headers = {'X-High-Water-Mark': until.isoformat()} if until is not None else {}
+    return StreamingResponse(content(), media_type=writers.STREAM_FORMATS['ndjson'], headers=headers)
+
+
+@app.get("/export-bundle", tags=["Data"])
+def bundle(
+        campaign: str,
+        network: List[str] = Query(None, description="Network ids, repeat it to combine several networks"),
+        language: str = None,
+        # current_user: schemas.ApiUser = Depends(get_current_active_user),
+        db: Session = Depends(get_db)
+):
+    """ZIP of the export and review workbooks of every method of a campaign, built in parallel."""
+    crud.language_suffix(language)
+    methods = crud.get_campaign_methods(db, campaign)
+    if not methods:
+        raise HTTPException(status_code=404, detail="No answers found")
+    headers = {'Content-Disposition': 'attachment; filename="bundle_' + campaign + '.zip"'}
+    members = jobs.iter_bundle(campaign, methods, network=network, language=language)
+    return StreamingResponse(writers.iter_zip(members), media_type='application/zip', headers=headers)
 
 
 @app.get("/export-entities", tags=["Data"])
@@ -196,19 +348,135 @@ def entities(
         # current_user: schemas.ApiUser = Depends(get_current_active_user),
         db: Session = Depends(get_db)
 ):
-    file = crud.get_export_entities(db, region1=region1, language=language)
-    headers = {'Content-Disposition': 'attachment; filename="' + file + '"'}
-    return FileResponse(crud.get_export_entities(db, region1=region1, language=language),
-                        headers=headers)
+    path, filename = exports.build(db, 'export-entities', region1=region1, language=language)
+    headers = {'Content-Disposition': 'attachment; filename="' + filename + '"'}
+    return FileResponse(path, headers=headers)
 
 
 
 @app.get("/export-entities-web", tags=["Data"])
-def entities(
+async def entities(
         network_type: str = None,
         language: str = None,
+        region1: str = None,
+        sector: str = None,
+        fields: str = Query(None, description="Comma separated list of the fields to return"),
+        after: str = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+        limit: int = Query(None, ge=1, le=ENTITIES_PAGE_MAX),
+        if_none_match: str = Header(None),
+        accept_encoding: str = Header(None),
         # current_user: schemas.ApiUser = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    return crud.get_export_entities_web(db, network_type=network_type, language=language)
-
+    params = dict(network_type=network_type, language=language, region1=region1, sector=sector,
+                  fields=fields.split(',') if fields else None, after=after, limit=limit)
+    version = await db.run_sync(crud.get_entities_version)
+    tag = responses.etag('export-entities-web', params, version)
+    if responses.matches(if_none_match, tag):
+        return responses.not_modified(tag)
+
+    entities, next_cursor = await crud.get_export_entities_web_async(db, **params)
+    content = await run_in_threadpool(lambda: dumps(jsonable_encoder(entities)))
+    # the cursor is part of the cached representation, a 304 keeps the one the client already has
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor is not None else None
+    return await responses.compress_async(responses.json_response(content, tag, headers), accept_encoding)
+
+
+@app.get("/aggregates", tags=["Data"])
+async def aggregates(
+        campaign: str,
+        method: str,
+        group_by: str = Query('all', description="Peer groups: all, sector, region1 or network"),
+        group: str = Query(None, description="Id of a single sector, region1 or network"),
+        indicator: str = None,
+        if_none_match: str = Header(None),
+        accept_encoding: str = Header(None),
+        # current_user: schemas.ApiUser = Depends(get_current_active_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    """Count, mean and quantiles of the answered values per indicator and gender among peer organizations."""
+    version, rollups = await crud.get_aggregates_async(db, campaign=campaign, method=method, group_by=group_by,
+                                                       group=group, indicator=indicator)
+    tag = responses.etag('aggregates', campaign, method, group_by, group, indicator, version)
+    if responses.matches(if_none_match, tag):
+        return responses.not_modified(tag)
+    content = await run_in_threadpool(dumps, rollups)
+    return await responses.compress_async(responses.json_response(content, tag), accept_encoding)
+
+
+@app.get("/entities-geo", tags=["Data"])
+async def entities_geo(
+        bbox: str = Query(..., description="west,south,east,north in degrees"),
+        zoom: int = Query(..., ge=0, le=22),
+        if_none_match: str = Header(None),
+        accept_encoding: str = Header(None),
+        # current_user: schemas.ApiUser = Depends(get_current_active_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    """Organizations inside ``bbox``, grouped in clusters with their count below the clustering zoom."""
+    try:
+        west, south, east, north = geo.parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    index = await db.run_sync(geo.current)
+    tag = responses.etag('entities-geo', bbox, zoom, index.version)
+    if responses.matches(if_none_match, tag):
+        return responses.not_modified(tag)
+    content = await run_in_threadpool(lambda: dumps(index.query(west, south, east, north, zoom)))
+    return await responses.compress_async(responses.json_response(content, tag), accept_encoding)
+
+
+def job_status(job: jobs.Job):
+    return schemas.ExportJob(id=job.id, kind=job.kind, status=job.status, queue_position=jobs.queue_position(job),
+                             created_at=job.created_at, finished_at=job.finished_at, filename=job.filename,
+                             error=job.error)
+
+
+@app.post("/export-jobs", tags=["Data"], response_model=schemas.ExportJob, status_code=status.HTTP_202_ACCEPTED)
+def create_export_job(
+        request: schemas.ExportJobCreate,
+        # current_user: schemas.ApiUser = Depends(get_current_active_user),
+):
+    if request.kind not in exports.builders:
+        raise HTTPException(status_code=400, detail=f"Unknown export kind, expected one of {', '.join(exports.builders)}")
+    if request.kind == 'export-entities':
+        params = dict(region1=request.region1, language=request.language)
+    elif request.campaign is None or request.method is None:
+        raise HTTPException(status_code=400, detail="campaign and method are required")
+    else:
+        params = dict(campaign=request.campaign, method=request.method, organization=request.organization,
+                      project=request.project, language=request.language, network=request.network)
+    return job_status(jobs.submit(request.kind, params))
+
+
+@app.get("/export-jobs/{job_id}", tags=["Data"], response_model=schemas.ExportJob)
+def get_export_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job_status(job)
+
+
+@app.get("/export-jobs/{job_id}/download", tags=["Data"])
+def download_export_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    if job.status != 'done':
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    headers = {'Content-Disposition': 'attachment; filename="' + job.filename + '"'}
+    return FileResponse(job.path, headers=headers)
+
+
+@app.on_event("startup")
+def startup():
+    # schema management is an explicit step (python initialize.py schema), this is only for local setups
+    if CREATE_SCHEMA_ON_STARTUP:
+        from . import schema
+        schema.upgrade()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    jobs.shutdown()
+    await async_engine.dispose()
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+class ExportCache:
+    """Content addressed store of built export files.
+
+    Every artifact lives in ``directory`` as ``<key>.xlsx`` next to a ``<key>.json`` sidecar holding the
+    download filename and the creation time. The file mtime is bumped on every hit, so eviction can drop
+    the least recently used artifacts once the store grows over ``max_bytes``; artifacts older than
+    ``max_age`` seconds are dropped regardless of use.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age: int, suffix: str = '.xlsx'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(**parts):
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + self.suffix, base + '.json'
+
+    def get(self, key):
+        """Return ``(path, filename)`` of a cached artifact, or None."""
+        path, meta = self._paths(key)
+        try:
+            with open(meta) as f:
+                info = json.load(f)
+            if time.time() - info['created'] > self.max_age:
+                return None
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return path, info['filename']
+
+    def workdir(self):
+        """Private scratch directory to build an artifact in, on the same filesystem as the store."""
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.mkdtemp(prefix='build-', dir=self.directory)
+
+    def put(self, key, source: str, filename: str):
+        """Move a freshly built file into the store and return its cached path."""
+        path, meta = self._paths(key)
+        os.makedirs(self.directory, exist_ok=True)
+        os.replace(source, path)
+        tmp = meta + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'filename': filename, 'created': time.time()}, f)
+        os.replace(tmp, meta)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: str = None):
+        with self._lock:
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(self.suffix):
+                    continue
+                path, meta = self._paths(name[:-len(self.suffix)])
+                try:
+                    st = os.stat(path)
+                    with open(meta) as f:
+                        created = json.load(f)['created']
+                except (OSError, ValueError, KeyError):
+                    continue
+                if now - created > self.max_age:
+                    self._remove(path, meta)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path, meta))
+
+            total = sum(e[1] for e in entries)
+            for _, size, path, meta in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                self._remove(path, meta)
+                total -= size
+
+    @staticmethod
+    def _remove(*paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def discard(directory):
+        shutil.rmtree(directory, ignore_errors=True)
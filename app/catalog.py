@@ -0,0 +1,83 @@
+"""Campaign, method, section and indicator labels, in every language, kept in memory.
+
+The labels are denormalized into every row of external.answers_calc_agg but only change when a method is
+published, so queries fetch ids and values and the labels are joined back when the rows are serialized.
+Catalogs are loaded per campaign and method (crud.get_catalog) and live CATALOG_TTL seconds, or less when rows
+of an indicator they do not know turn up. Their ``version`` is part of the export cache key, so relabelled
+workbooks are rebuilt.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from .config import CATALOG_TTL
+
+TRANSLATED = ('campaign_name', 'method_name', 'method_description', 'method_section_title', 'indicator_name',
+              'indicator_description')
+PLAIN = ('id_campaign', 'year', 'id_method', 'id_methods_section', 'path_order', 'method_level', 'indicator_code',
+         'is_direct_indicator', 'indicator_category', 'indicator_data_type', 'indicator_unit')
+
+
+class Catalog:
+    """Labels of the indicators of one campaign and method, keyed by indicator id."""
+
+    def __init__(self, rows, suffixes):
+        self.suffixes = tuple(suffixes)
+        self.indicators = {}
+        for row in rows:
+            entry = {f: row[f] for f in PLAIN}
+            entry.update({f: {s: row[f + s] for s in self.suffixes} for f in TRANSLATED})
+            self.indicators[str(row['id_indicator'])] = entry
+        content = json.dumps(sorted(self.indicators.items()), default=str)
+        self.version = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        self._labels = {}
+
+    def covers(self, indicators):
+        return all(str(id_indicator) in self.indicators for id_indicator in indicators)
+
+    def labels(self, id_indicator, suffix: str = ''):
+        """Plain fields and the ``suffix`` translation of the labels of an indicator, empty if unknown."""
+        key = (str(id_indicator), suffix)
+        labels = self._labels.get(key)
+        if labels is None:
+            entry = self.indicators.get(key[0])
+            if entry is None:
+                return {}
+            labels = {f: entry[f][suffix] if f in TRANSLATED else entry[f] for f in entry}
+            labels['id_indicator'] = key[0]
+            self._labels[key] = labels
+        return labels
+
+    def label_rows(self, suffix: str = ''):
+        return [self.labels(id_indicator, suffix) for id_indicator in self.indicators]
+
+    def name(self, field: str, suffix: str = ''):
+        """Label shared by every indicator, like the campaign or method name, None for an empty catalog."""
+        for entry in self.indicators.values():
+            return entry[field][suffix]
+        return None
+
+
+class CatalogCache:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def put(self, key, catalog: Catalog):
+        now = time.monotonic()
+        with self._lock:
+            for expired in [k for k, entry in self._entries.items() if entry[0] < now]:
+                del self._entries[expired]
+            self._entries[key] = (now + self.ttl, catalog)
+
+
+catalogs = CatalogCache(CATALOG_TTL)
@@ -6,3 +6,63 @@ load_dotenv(dotenv_path='.env.devel', override=True)
 SECRET_KEY = os.environ.get('SECRET_KEY')
 ALGORITHM = os.environ.get('ALGORITHM')
 ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES')
+
+# Built .xlsx exports are kept on disk and reused while the data they were built from is unchanged
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', 'export_cache')
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+EXPORT_CACHE_MAX_AGE = int(os.environ.get('EXPORT_CACHE_MAX_AGE', 7 * 24 * 3600))
+
+# Background export jobs, their state and files live in EXPORT_JOB_DIR, shared by every API worker process
+EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', 2))
+EXPORT_JOB_DIR = os.environ.get('EXPORT_JOB_DIR', 'export_jobs')
+EXPORT_JOB_TTL = int(os.environ.get('EXPORT_JOB_TTL', 24 * 3600))
+
+# How /answers documents are built: 'json_agg' nests them in Postgres, 'python' fetches flat rows and nests them here
+ANSWERS_ENGINE = os.environ.get('ANSWERS_ENGINE', 'json_agg')
+
+# Database connection pools, the async pool serves the JSON endpoints and the sync one the exports
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+# Authenticated principals are cached per token so a burst of requests queries the user once. Deactivating a
+# user clears the cache of the worker process that served it at once and the other workers' once their entry
+# expires, so this bounds how long a deactivated user is still accepted.
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 5))
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 1024))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+# Run the migrations when the app starts, meant for local development only
+CREATE_SCHEMA_ON_STARTUP = os.environ.get('CREATE_SCHEMA_ON_STARTUP', 'false').lower() in ('1', 'true', 'yes')
+
+# Largest page /export-entities-web hands out when a limit is asked for
+ENTITIES_PAGE_MAX = int(os.environ.get('ENTITIES_PAGE_MAX', 1000))
+
+# JSON data endpoints: Cache-Control sent along their ETags, and the encodings offered in order of preference
+# ('br' needs the brotli package). The level is used for both gzip (1-9) and brotli (0-11).
+CACHE_CONTROL = os.environ.get('CACHE_CONTROL', 'private, no-cache')
+HTTP_COMPRESSION = [e.strip() for e in os.environ.get('HTTP_COMPRESSION', 'br,gzip').split(',') if e.strip()]
+HTTP_COMPRESSION_LEVEL = int(os.environ.get('HTTP_COMPRESSION_LEVEL', 6))
+HTTP_COMPRESSION_MIN_SIZE = int(os.environ.get('HTTP_COMPRESSION_MIN_SIZE', 1024))
+
+# /entities-geo: organizations are clustered on a grid of GEO_CLUSTER_CELLS x GEO_CLUSTER_CELLS cells per map
+# tile below GEO_CLUSTER_MAX_ZOOM
+GEO_CLUSTER_CELLS = int(os.environ.get('GEO_CLUSTER_CELLS', 4))
+GEO_CLUSTER_MAX_ZOOM = int(os.environ.get('GEO_CLUSTER_MAX_ZOOM', 12))
+
+# The organizations fingerprint (ETags of /export-entities-web, the geo index) and the peer groups one (answers
+# rollups) are recomputed at most this often
+ENTITIES_REFRESH_SECONDS = int(os.environ.get('ENTITIES_REFRESH_SECONDS', 60))
+
+# Campaign, method, section and indicator labels are cached in memory for this many seconds
+CATALOG_TTL = int(os.environ.get('CATALOG_TTL', 600))
+
+# Network memberships are kept in memory, checked against the database at most every NETWORK_REFRESH_SECONDS
+NETWORK_REFRESH_SECONDS = int(os.environ.get('NETWORK_REFRESH_SECONDS', 60))
+
+# Admission control of the expensive endpoints, as path=concurrency:queue items: at most concurrency requests
+# per path run at once in each process and up to queue more wait, each at most ADMISSION_QUEUE_TIMEOUT seconds
+ADMISSION_LIMITS = os.environ.get('ADMISSION_LIMITS', '/export-answers=2:8,/review-answers=2:8,/export-entities=1:4,'
+                                                     '/export-bundle=1:2,/answers/bulk=2:8')
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30))
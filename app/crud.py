@@ -1,20 +1,29 @@
-from fastapi.responses import JSONResponse
+from fastapi import HTTPException
 from fastapi.encoders import jsonable_encoder
 
 import datetime
+import itertools
+import json
+import os
+import time
 from jose import JWTError, jwt
-import pandas as pd
-from coopdevsutils import querytodataframe
 
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from typing import Optional
 
 from . import models, schemas
-from app.utils import get_password_hash, verify_password
-from sqlalchemy.sql import text
-from openpyxl.utils import get_column_letter
+from app.utils import get_password_hash, verify_password, verify_password_async
+from sqlalchemy.sql import bindparam, text
+from sqlalchemy.types import NullType
 
-from .config import ALGORITHM, SECRET_KEY
+from .config import ALGORITHM, ANSWERS_ENGINE, ENTITIES_REFRESH_SECONDS, SECRET_KEY
+from . import metrics, networks, responses, statements
+from .principals import principals
+from .catalog import TRANSLATED, Catalog, catalogs
+from .database import offload
+from .tree import build_answers
+from .writers import json_default, write_sheets
 
 
 def get_user(db: Session, user_id: int):
@@ -42,6 +51,18 @@ def create_user(db: Session, user: schemas.ApiUserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    principals.invalidate(db_user.username)
+    return db_user
+
+
+def set_user_active(db: Session, username: str, is_active: bool):
+    db_user = get_user_by_username(db, username)
+    if db_user is None:
+        return None
+    db_user.is_active = is_active
+    db.commit()
+    db.refresh(db_user)
+    principals.invalidate(username)
     return db_user
 
 
@@ -54,6 +75,16 @@ def authenticate_user(db: Session, username: str, password: str):
     return user
 
 
+async def authenticate_user_async(db, username: str, password: str):
+    """authenticate_user on an AsyncSession, with the bcrypt check kept off the event loop."""
+    user = await db.run_sync(get_user_by_username, username)
+    if not user:
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    return user
+
+
 def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -65,10 +96,243 @@ def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta]
     return encoded_jwt
 
 
+LANGUAGES = ('en', 'ca', 'es', 'eu', 'gl', 'nl', 'fr')
+
+
+def language_suffix(language: str = None):
+    """Column suffix of a translated field; only whitelisted languages ever reach the SQL text."""
+    if language is None:
+        return ""
+    if language not in LANGUAGES:
+        raise HTTPException(status_code=400, detail=f"Unsupported language, expected one of {', '.join(LANGUAGES)}")
+    return "_" + language
+
+
+def query(qry: str, **params):
+    """Text clause with ``params`` bound.
+
+    Binds are left untyped so Postgres infers their type from the column they are compared with (ids are
+    uuids), and list values expand to one bind per element for ``in :name`` filters.
+    """
+    binds = [bindparam(name, value, type_=NullType(), expanding=isinstance(value, (list, tuple)))
+             for name, value in params.items()]
+    return text(qry).bindparams(*binds)
+
+
+def scope_organizations(db, organization: str = None, network: list = None):
+    """Organization ids an answers query is restricted to, or None when it is not.
+
+    ``network`` takes one or several network ids, their members come from the in-process networks index,
+    and an ``organization`` outside of them gives an empty scope.
+    """
+    if isinstance(network, str):
+        network = [network]
+    if not network:
+        return [organization] if organization is not None else None
+    members = networks.organizations(db, network)
+    if organization is not None:
+        return [organization] if organization in members else []
+    return members
+
+
+def organizations_filter(column: str, organizations: list, params: dict):
+    """Condition restricting ``column`` to a scope_organizations result, adding its parameter to ``params``."""
+    if organizations is None:
+        return ""
+    if len(organizations) == 1:
+        params['organization'] = organizations[0]
+        return f" and {column} = :organization"
+    # one array parameter whatever the number of organizations, so the statement text stays the same and can
+    # be prepared; it is bound as an array literal, which Postgres casts like any untyped string
+    params['organizations'] = array_literal(organizations)
+    return f" and {column} = any(cast(:organizations as uuid[]))"
+
+
+def array_literal(values):
+    """Postgres array literal of ``values``, every element quoted."""
+    quoted = ('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return '{' + ','.join(quoted) + '}'
+
+
+def get_answers_versions(db, organization: str = None):
+    """Data version of every (organization, campaign) pair, covering the previous campaign it is compared with."""
+    orga = " where a.id_organization = :organization" if organization is not None else ""
+    params = dict(organization=organization) if organization is not None else {}
+    qry = f"""
+        with v as (
+            select a.id_organization::text as id_organization, a.id_campaign::text as id_campaign
+                , min(a.previous_campaign_id::text) as previous_campaign_id
+                , max(a.survey_updated_at) as updated_at, count(*) as n
+            from external.answers_calc_agg a
+            {orga}
+            group by a.id_organization, a.id_campaign
+        )
+        select v.id_organization, v.id_campaign, concat_ws('|', v.updated_at, v.n, p.updated_at, p.n) as version
+        from v
+        left join v p on p.id_organization = v.id_organization and p.id_campaign = v.previous_campaign_id
+    """
+    registries = statements.execute(db, query(qry, **params))
+    return {(r.id_organization, r.id_campaign): r.version for r in registries}
+
+
 def get_answers(db, organization: str, campaign: str, method: str, project: str = None, language: str = None,
-                direct_indicators: bool = True):
-    lang = ("_" + language) if language is not None else ""
-    prj = f" and a.id_project='{project}'" if project is not None and project != '' else " and a.id_project is null"
+                direct_indicators: bool = True, if_none_match: str = None):
+    """Serve the stored answers document, rebuilding it first if its surveys changed since it was stored.
+
+    The response ETag comes from the data version alone, so a matching ``if_none_match`` is answered with
+    a 304 before the stored document is even read.
+    """
+    key = dict(id_organization=organization, id_campaign=campaign, id_method=method, id_project=project or '',
+               language=language or '', direct_indicators=direct_indicators)
+    with metrics.stage('version'):
+        version = get_answers_versions(db, organization=organization).get((organization, campaign), '')
+    tag = responses.etag('answers', key, version) if version else None
+    if responses.matches(if_none_match, tag):
+        return responses.not_modified(tag)
+
+    with metrics.stage('stored'):
+        stored = db.query(models.AnswersDocument).filter_by(**key).first()
+    if version and stored is not None and stored.version == version:
+        return responses.json_response(stored.document, tag)
+
+    with metrics.stage('build'):
+        document = answers_document(db, organization=organization, campaign=campaign, method=method,
+                                    project=project, language=language, direct_indicators=direct_indicators)
+    if version:
+        with metrics.stage('save'):
+            save_answers_document(db, key, version, document)
+    return responses.json_response(document, tag)
+
+
+async def get_answers_async(db, **kwargs):
+    """get_answers on an AsyncSession, running over the async pool without a worker thread."""
+    return await db.run_sync(get_answers, **kwargs)
+
+
+def save_answers_document(db, key: dict, version: str, document: str):
+    values = dict(key, version=version, document=document, refreshed_at=datetime.datetime.utcnow())
+    stmt = insert(models.AnswersDocument).values(**values)
+    stmt = stmt.on_conflict_do_update(index_elements=list(key),
+                                      set_=dict(version=version, document=document,
+                                                refreshed_at=values['refreshed_at']))
+    db.execute(stmt)
+    db.commit()
+
+
+def refresh_answer_documents(db):
+    """Rebuild the stored answers documents whose surveys changed since they were built, returns how many."""
+    versions = get_answers_versions(db)
+    doc = models.AnswersDocument
+    stored = db.query(doc.id_organization, doc.id_campaign, doc.id_method, doc.id_project, doc.language,
+                      doc.direct_indicators, doc.version).all()
+    refreshed = 0
+    for row in stored:
+        version = versions.get((row.id_organization, row.id_campaign), '')
+        if version == row.version:
+            continue
+        document = answers_document(db, organization=row.id_organization, campaign=row.id_campaign,
+                                    method=row.id_method, project=row.id_project or None,
+                                    language=row.language or None, direct_indicators=row.direct_indicators)
+        key = dict(row._mapping)
+        key.pop('version')
+        save_answers_document(db, key, version, document)
+        refreshed += 1
+    return refreshed
+
+
+def answers_document(db, organization: str, campaign: str, method: str, project: str = None, language: str = None,
+                     direct_indicators: bool = True, engine: str = None):
+    """Nested answers document as JSON text, built by the ANSWERS_ENGINE chosen in config."""
+    build = answers_document_tree if (engine or ANSWERS_ENGINE) == 'python' else answers_document_json_agg
+    return build(db, organization=organization, campaign=campaign, method=method, project=project,
+                 language=language, direct_indicators=direct_indicators)
+
+
+def answers_flat_query(campaign: str, method: str, organizations: list = None, project: str = None,
+                       language: str = None, direct_indicators: bool = True):
+    """One row per indicator result with only the requested language, ordered for tree.build_answers.
+
+    Rows are grouped by organization first, so several organizations can be fetched in one pass. None
+    ``organizations`` means all of them, an empty list none.
+    """
+    lang = language_suffix(language)
+    params = dict(campaign=campaign, method=method)
+    orga = organizations_filter('a.id_organization', organizations, params)
+    prj = " and a.id_project = :project" if project is not None and project != '' else " and a.id_project is null"
+    if project is not None and project != '':
+        params['project'] = project
+    dr = ' and a.is_direct_indicator' if direct_indicators else 'and not a.is_direct_indicator'
+    qry = f"""
+        select a.id_campaign, a.campaign_name{lang} as campaign_name
+            , a.id_survey, a.survey_created_at, a.survey_updated_at, a.status
+            , a.id_organization, a.organization_name, a.vat_number, a.id_project, a.project_name
+            , a.id_method, a.method_name{lang} as method_name, a.method_description{lang} as method_description
+            , coalesce(a.id_methods_section, 'e2ef801f-adbc-60d2-36d0-0b9f3516ebc7') id_methods_section
+            , a.method_section_title{lang} as method_section_title, a.path_order, a.method_level
+            , a.id_indicator, a.indicator_code, a.indicator_name{lang} as indicator_name
+            , a.indicator_description{lang} as indicator_description
+            , a.is_direct_indicator, a.indicator_category, a.indicator_data_type, a.indicator_unit
+            , a.gender{lang} as gender, a.value, a.str_gender{lang} as str_gender, a.str_list{lang} as str_list
+            , a.str_value{lang} as str_value
+            , p.gender{lang} as prev_gender, p.value as prev_value, p.str_gender{lang} as prev_str_gender
+            , p.str_value{lang} as prev_str_value
+        from external.answers_calc_agg a
+        left join external.answers_calc_agg p on a.id_organization = p.id_organization and a.previous_campaign_id  = p.id_campaign 
+            and a.id_indicator = p.id_indicator
+        where a.id_campaign = :campaign
+            and a.id_method = :method
+            {orga}
+            {prj}
+            {dr}
+        order by a.id_organization, a.id_campaign, a.id_survey, a.id_method, a.path_order, id_methods_section
+            , a.indicator_code, a.id_indicator, gender, prev_gender
+    """
+    return query(qry, **params)
+
+
+def answers_document_tree(db, organization: str, campaign: str, method: str, project: str = None,
+                          language: str = None, direct_indicators: bool = True):
+    qry = answers_flat_query(campaign=campaign, method=method, organizations=[organization], project=project,
+                             language=language, direct_indicators=direct_indicators)
+    with metrics.stage('sql'):
+        registries = statements.execute(db, qry).fetchall()
+    metrics.rows('sql', len(registries))
+    with metrics.stage('nest'):
+        return offload(_nest_answers, registries)
+
+
+def _nest_answers(registries):
+    content = build_answers(row._mapping for row in registries)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=json_default)
+
+
+def iter_answers(db, campaign: str, method: str, organizations: list = None, network: list = None,
+                 project: str = None, language: str = None, direct_indicators: bool = True):
+    """Yield ``(organization, answers)`` for every organization in scope, from one streamed query."""
+    if network:
+        members = scope_organizations(db, network=network)
+        organizations = members if organizations is None else sorted(set(organizations) & set(members))
+    qry = answers_flat_query(campaign=campaign, method=method, organizations=organizations, project=project,
+                             language=language, direct_indicators=direct_indicators)
+    registries = metrics.counted(db.execute(qry.execution_options(stream_results=True)), 'sql')
+    rows = (row._mapping for row in registries)
+    for organization, group in itertools.groupby(rows, key=lambda row: row['id_organization']):
+        yield organization, build_answers(group)
+
+
+def answers_document_json_agg(db, organization: str, campaign: str, method: str, project: str = None,
+                              language: str = None, direct_indicators: bool = True, raw: bool = True):
+    """Answers document nested by Postgres.
+
+    With ``raw`` the aggregate is cast to text and its bytes are returned as they come from the server,
+    without parsing them into Python objects and serializing them back. Whitespace differs from the
+    parsed path (``raw=False``), the JSON values are the same.
+    """
+    lang = language_suffix(language)
+    params = dict(organization=organization, campaign=campaign, method=method)
+    prj = " and a.id_project = :project" if project is not None and project != '' else " and a.id_project is null"
+    if project is not None and project != '':
+        params['project'] = project
     dr = ' and a.is_direct_indicator' if direct_indicators else 'and not a.is_direct_indicator'
     qry = f"""
         with res as (
@@ -98,9 +362,9 @@ def get_answers(db, organization: str, campaign: str, method: str, project: str
                 from external.answers_calc_agg a
                 left join external.answers_calc_agg p on a.id_organization = p.id_organization and a.previous_campaign_id  = p.id_campaign 
                     and a.id_indicator = p.id_indicator
-                where a.id_organization='{organization}'
-                and a.id_campaign = '{campaign}'	
-                and a.id_method = '{method}'
+                where a.id_organization = :organization
+                and a.id_campaign = :campaign
+                and a.id_method = :method
                 {prj}	
                 {dr}
         )
@@ -129,7 +393,7 @@ def get_answers(db, organization: str, campaign: str, method: str, project: str
                 , gender{lang} as gender, value, str_gender{lang} as str_gender, str_list{lang} as str_list, str_value{lang} as str_value
                 , prev_gender{lang} as prev_gender, prev_value, prev_str_gender{lang} as prev_str_gender, prev_str_list{lang} as prev_str_list, prev_str_value{lang} as prev_str_value
             from res)		
-        SELECT json_agg(t) as json_agg
+        SELECT json_agg(t){"::text" if raw else ""} as json_agg
         from (
             select c.id_campaign, c.campaign_name 
                 , (
@@ -178,61 +442,236 @@ def get_answers(db, organization: str, campaign: str, method: str, project: str
             ) t
     """
 
-    registries = db.execute(text(qry))
-    row = registries.fetchone()
-    return JSONResponse(content=jsonable_encoder(dict(row._mapping))["json_agg"])
+    with metrics.stage('sql'):
+        row = statements.execute(db, query(qry, **params)).fetchone()
+    if raw:
+        # json_agg over no rows is null
+        return row.json_agg if row.json_agg is not None else "null"
+    content = jsonable_encoder(dict(row._mapping))["json_agg"]
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"))
 
 
-def get_review_answers(db
-                       , campaign: str
-                       , method: str
-                       , organization: str = None
-                       , project: str = None
-                       , network: str = None
-                       , language: str = None):
-    lang = ("_" + language) if language is not None else ""
-    orga = f" and a.id_organization='{organization}'" if organization is not None else ""
-    prj = f" and a.id_project='{project}'" if project is not None and project != '' else ""
-    net = f"""
-        and exists (
-            select *
-            from syh_settings_network_organizations n
-            where a.id_organization = n.organization_id 
-                and n.network_id='{network}'
-            )
-        """ if network is not None else ""
+def get_data_version(db, campaign: str, method: str = None, organization: str = None, project: str = None):
+    """Latest survey update in the scope of an export, used to tell whether a built export is still current."""
+    params = dict(campaign=campaign)
+    mtd = " and a.id_method = :method" if method is not None else ""
+    orga = " and a.id_organization = :organization" if organization is not None else ""
+    prj = " and a.id_project = :project" if project is not None and project != '' else ""
+    params.update({k: v for k, v in dict(method=method, organization=organization, project=project).items() if v})
+    qry = f"""
+        select max(a.survey_updated_at) as version, count(*) as n
+        from external.answers_calc_agg a
+        where a.id_campaign = :campaign
+            {mtd}
+            {orga}
+            {prj}
+    """
+    row = statements.execute(db, query(qry, **params)).fetchone()
+    return f"{row.version}|{row.n}"
+
+
+def get_data_versions(db):
+    """get_data_version of every campaign and method at once."""
+    qry = """
+        select a.id_campaign::text as id_campaign, a.id_method::text as id_method
+            , max(a.survey_updated_at) as version, count(*) as n
+        from external.answers_calc_agg a
+        group by a.id_campaign, a.id_method
+    """
+    return {(r.id_campaign, r.id_method): f"{r.version}|{r.n}" for r in db.execute(query(qry))}
+
+
+# peer group -> (group id expression, join it needs) for the answers rollups
+ROLLUP_GROUPS = {
+    'all': ("''", ""),
+    'sector': ("so.sector_id::text",
+               "join syh_organizations_organization_sectors so on so.organization_id = a.id_organization"),
+    'region1': ("o.region1_id::text", "join syh_organizations_organization o on o.id = a.id_organization"),
+    'network': ("no.network_id::text",
+                "join syh_settings_network_organizations no on no.organization_id = a.id_organization"),
+}
+ROLLUP_COLUMNS = ('group_id', 'id_indicator', 'indicator_code', 'gender', 'n', 'mean', 'p10', 'p25', 'median',
+                  'p75', 'p90')
+
+
+# (monotonic time it was computed, fingerprint) of get_peer_groups_version
+_peer_groups_version = (None, None)
+
+
+def get_peer_groups_version(db):
+    """Fingerprint of what puts organizations in a peer group: their region1, sectors and networks.
+
+    Like get_entities_version it hashes every row of those tables, so it is computed at most every
+    ENTITIES_REFRESH_SECONDS.
+    """
+    global _peer_groups_version
+    checked, version = _peer_groups_version
+    now = time.monotonic()
+    if checked is not None and now - checked < ENTITIES_REFRESH_SECONDS:
+        return version
+    qry = """
+        select concat_ws('|'
+            , (select md5(string_agg(concat(o.id, ':', o.region1_id), ',' order by o.id))
+               from syh_organizations_organization o)
+            , (select md5(string_agg(concat(so.organization_id, ':', so.sector_id), ',' order by so.organization_id, so.sector_id))
+               from syh_organizations_organization_sectors so)
+        )
+    """
+    version = f"{statements.execute(db, query(qry)).scalar()}|{networks.current(db).version}"
+    _peer_groups_version = (now, version)
+    return version
+
+
+def get_rollup_version(db, campaign: str, method: str, groups: str = None, data: str = None):
+    """Version of the rollups of a campaign and method: their surveys (``data``) and the peer groups (``groups``)."""
+    groups = groups if groups is not None else get_peer_groups_version(db)
+    data = data if data is not None else get_data_version(db, campaign=campaign, method=method)
+    return f"{data}|{groups}"
+
+
+def refresh_rollup(db, campaign: str, method: str):
+    """Recompute the answers rollups of a campaign and method for every peer group, returns their version.
+
+    Only organization level answers (no project) with a value are counted. Concurrent refreshes of the same
+    campaign and method queue on an advisory lock, and the ones that were beaten to it just commit.
+    """
+    db.execute(query("select pg_advisory_xact_lock(hashtext(:key))", key=f"answers_rollup|{campaign}|{method}"))
+    version = get_rollup_version(db, campaign, method)
+    rollup = models.AnswersRollup
+    stored = db.query(rollup.version).filter_by(id_campaign=campaign, id_method=method).first()
+    if stored is not None and stored.version == version:
+        db.commit()
+        return version
+
+    db.query(rollup).filter_by(id_campaign=campaign, id_method=method).delete()
+    for group_by, (group_id, join) in ROLLUP_GROUPS.items():
+        qry = f"""
+            insert into answers_rollup (id_campaign, id_method, group_by, group_id, id_indicator, indicator_code
+                , gender, n, mean, p10, p25, median, p75, p90, version, refreshed_at)
+            select :campaign, :method, :group_by, s.group_id, s.id_indicator, s.indicator_code, s.gender, s.n, s.mean
+                , s.p[1], s.p[2], s.p[3], s.p[4], s.p[5], :version, now() at time zone 'utc'
+            from (
+                select {group_id} as group_id, a.id_indicator::text as id_indicator
+                    , min(a.indicator_code) as indicator_code, coalesce(a.gender, '') as gender
+                    , count(*) as n, avg(a.value::float8) as mean
+                    , percentile_cont(array[0.1, 0.25, 0.5, 0.75, 0.9]) within group (order by a.value::float8) as p
+                from external.answers_calc_agg a
+                {join}
+                where a.id_campaign = :campaign
+                    and a.id_method = :method
+                    and a.id_project is null
+                    and a.value is not null
+                    and {group_id} is not null
+                group by 1, 2, 4
+            ) s
+        """
+        with metrics.stage('rollup'):
+            db.execute(query(qry, campaign=campaign, method=method, group_by=group_by, version=version))
+    # marks the rollups current even when no answer qualified for any peer group
+    db.add(rollup(id_campaign=campaign, id_method=method, group_by='', id_indicator='', n=0, version=version))
+    db.commit()
+    return version
+
+
+def refresh_answer_rollups(db):
+    """Recompute the stored answers rollups whose surveys or peer groups changed since, returns how many."""
+    versions = get_data_versions(db)
+    groups = get_peer_groups_version(db)
+    rollup = models.AnswersRollup
+    stored = db.query(rollup.id_campaign, rollup.id_method, rollup.version).distinct().all()
+    refreshed = 0
+    for row in stored:
+        if f"{versions.get((row.id_campaign, row.id_method))}|{groups}" != row.version:
+            refresh_rollup(db, campaign=row.id_campaign, method=row.id_method)
+            refreshed += 1
+    return refreshed
+
+
+def get_aggregates(db, campaign: str, method: str, group_by: str = 'all', group: str = None,
+                   indicator: str = None):
+    """``(version, rollups)`` of a campaign and method by peer group, recomputed first if surveys or groups changed."""
+    if group_by not in ROLLUP_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(ROLLUP_GROUPS)}")
+    rollup = models.AnswersRollup
+    with metrics.stage('version'):
+        data = get_data_version(db, campaign=campaign, method=method)
+        version = get_rollup_version(db, campaign, method, data=data)
+        if data.endswith('|0'):
+            # no surveys, or no such campaign and method: nothing to compute nor store
+            return version, []
+        stored = db.query(rollup.version).filter_by(id_campaign=campaign, id_method=method).first()
+    if stored is None or stored.version != version:
+        version = refresh_rollup(db, campaign=campaign, method=method)
+
+    rows = db.query(*[getattr(rollup, c) for c in ROLLUP_COLUMNS]).filter_by(
+        id_campaign=campaign, id_method=method, group_by=group_by)
+    if group is not None:
+        rows = rows.filter_by(group_id=group)
+    if indicator is not None:
+        rows = rows.filter_by(id_indicator=indicator)
+    rows = rows.order_by(rollup.group_id, rollup.indicator_code, rollup.gender)
+    return version, [dict(row._mapping) for row in rows]
+
+
+async def get_aggregates_async(db, **kwargs):
+    return await db.run_sync(get_aggregates, **kwargs)
+
+
+def review_answers_query(campaign: str
+                         , method: str
+                         , organizations: list = None
+                         , project: str = None
+                         , language: str = None):
+    """Long format review rows, grouped by indicator, for the scope_organizations ``organizations``."""
+    lang = language_suffix(language)
+    prj = " and a.id_project = :project" if project is not None and project != '' else ""
+    params = dict(campaign=campaign, method=method, project=project)
+    params = {k: v for k, v in params.items() if v}
+    orga = organizations_filter('a.id_organization', organizations, params)
 
     qry = f"""
-        select id_campaign, campaign_name{lang} as campaign_name, "year"
+        select id_campaign, campaign_name{lang} as campaign_name, id_method, method_name{lang} as method_name
+        , id_organization, organization_name, vat_number, user_email
         , id_survey, survey_created_at::timestamp without time zone, survey_updated_at::timestamp without time zone, status
-        , id_method, method_name{lang} as method_name, method_description{lang} as method_description
-        , id_user, user_name, user_surname, user_email, id_organization, organization_name, vat_number
-        , id_methods_section, method_section_title{lang} as method_section_title, method_order, method_level, path_order, sort_value
-        , id_indicator, indicator_code, indicator_name{lang} as indicator_name, indicator_description{lang} as indicator_description, indicator_category, indicator_data_type, indicator_unit
+        , id_indicator, indicator_code, indicator_name{lang} as indicator_name
         , str_gender{lang} as str_gender, str_value
         , id_project, project_name
         from external.answers_calc_agg a
          where 1=1 
          and a.is_direct_indicator
          and a.id_indicator is not null
-        and a.id_campaign = '{campaign}'
-        and a.id_method ='{method}'
+        and a.id_campaign = :campaign
+        and a.id_method = :method
         {orga}
         {prj}
-        {net}
-        order by a.id_organization, path_order, indicator_code
+        order by min(a.path_order) over (partition by a.indicator_code), a.indicator_code, a.id_organization, a.path_order
     """
-    cols = ['id_campaign', 'campaign_name', 'year'
-        , 'id_survey', 'survey_created_at', 'survey_updated_at', 'status'
-        , 'id_method', 'method_name', 'method_description'
-        , 'id_user', 'user_name', 'user_surname', 'user_email', 'id_organization', 'organization_name', 'vat_number'
-        , 'id_methods_section', 'method_section_title', 'method_order', 'method_level', 'path_order', 'sort_value'
-        , 'id_indicator', 'indicator_code', 'indicator_name', 'indicator_description', 'indicator_category',
-            'indicator_data_type', 'indicator_unit'
-        , 'str_gender', 'str_value', 'id_project', 'project_name']
-    conn = db.bind
-    df = querytodataframe(qry, cols, conn)
+    return query(qry, **params)
+
 
+def iter_query(db, qry):
+    """Run ``qry`` on a server side cursor and return its column names and a lazy row iterator."""
+    result = db.execute(qry.execution_options(stream_results=True))
+    return list(result.keys()), (tuple(row) for row in metrics.counted(result, 'sql'))
+
+
+def iter_review_answers(db, campaign: str, method: str, organization: str = None, project: str = None,
+                        network: list = None, language: str = None):
+    """Column names and a lazy iterator of the review rows."""
+    qry = review_answers_query(campaign=campaign, method=method,
+                               organizations=scope_organizations(db, organization, network), project=project,
+                               language=language)
+    return iter_query(db, qry)
+
+
+def get_review_answers(db
+                       , campaign: str
+                       , method: str
+                       , organization: str = None
+                       , project: str = None
+                       , network: list = None
+                       , language: str = None
+                       , directory: str = '.'):
     excelcolumns = ['indicator_name'
         , 'organization_name', 'vat_number', 'user_email'
         , 'survey_created_at', 'survey_updated_at'
@@ -243,127 +682,251 @@ def get_review_answers(db
             , 'survey_created_at', 'survey_updated_at'
             , 'str_gender', 'str_value']
 
-    with pd.ExcelWriter(f"{df.iloc[1]['campaign_name']}-{df.iloc[1]['method_name'].replace('/', '_')}.xlsx") as writer:
-        for x in df['indicator_code'].unique():
-            df1 = df.loc[df['indicator_code'] == x, excelcolumns]
-            df1.to_excel(writer, sheet_name=x, index=False)
-        return f"{df.iloc[1]['campaign_name']}-{df.iloc[1]['method_name']}.xlsx"
+    # rows come from a server side cursor already grouped by indicator, each group becomes a sheet
+    qry = review_answers_query(campaign=campaign, method=method,
+                               organizations=scope_organizations(db, organization, network), project=project,
+                               language=language)
+    with metrics.stage('sql'):
+        registries = iter(db.execute(qry.execution_options(stream_results=True)))
+        first = next(registries, None)
+    if first is None:
+        raise HTTPException(status_code=404, detail="No answers found")
 
+    filename = f"{first.campaign_name}-{first.method_name.replace('/', '_')}.xlsx"
+    path = os.path.join(directory, filename)
+    # the rest of the rows are fetched while the sheets are written
+    with metrics.stage('write'):
+        write_sheets(path, metrics.counted(itertools.chain([first], registries), 'sql'),
+                     sheet_of=lambda row: row['indicator_code'], columns=excelcolumns)
+    metrics.written('xlsx', os.path.getsize(path))
+    return filename
 
-def get_export_answers(db, campaign: str, method: str
-                       , organization: str = None
-                       , network: str = None
-                       , project: str = None,
-                       language: str = None):
-    lang = ("_" + language) if language is not None else ""
-    orga = f" and ac.id_organization='{organization}'" if organization is not None else ""
-    prj = f" and ac.id_project='{project}'" if project is not None and project != '' else ""
-    # prjcols = ", id_project, project_name " if project is not None and project != '' else ""
-    prjcols = ", id_project as id_project, coalesce(project_name,'') as project_name "
-    net = f"""
-            and exists (
-                select *
-                from syh_settings_network_organizations n
-                where ac.id_organization = n.organization_id 
-                    and n.network_id='{network}'
-            )   
-            """ if network is not None else ""
+
+def export_answers_query(campaign: str, method: str
+                         , organizations: list = None
+                         , project: str = None,
+                         language: str = None,
+                         since: datetime.datetime = None,
+                         until: datetime.datetime = None):
+    """Long format export values, one row per organization, answered indicator and classification.
+
+    Only ids and values are fetched, the labels are joined from the catalog (iter_export_answers).
+    ``organizations`` is a scope_organizations result, ``since`` and ``until`` keep only the surveys updated
+    after ``since`` and up to ``until``.
+    """
+    lang = language_suffix(language)
+    prj = " and ac.id_project = :project" if project is not None and project != '' else ""
+    params = dict(campaign=campaign, method=method, project=project, since=since, until=until)
+    params = {k: v for k, v in params.items() if v}
+    orga = organizations_filter('ac.id_organization', organizations, params)
+    orga += " and ac.survey_updated_at > :since" if since is not None else ""
+    orga += " and ac.survey_updated_at <= :until" if until is not None else ""
     qry = f"""
         with res as (
-            select  ac.campaign_name{lang} as campaign_name, ac."year", id_campaign
-                , ac.id_method,  ac.method_name{lang} as method_name
-                , ac.vat_number, ac.organization_name, ac.id_organization
-                , ac.method_section_title{lang} as method_section_title , ac.path_order 
-                , ac.id_indicator, ac.indicator_code , ac.indicator_name{lang} as indicator_name
-                , ac.is_direct_indicator , ac.indicator_category , ac.indicator_data_type 
-                {prjcols}
+            select ac.id_campaign, ac.id_method, ac.id_organization, ac.vat_number, ac.organization_name
+                , ac.id_project, coalesce(ac.project_name, '') as project_name
+                , ac.id_indicator, ac.path_order, ac.is_direct_indicator, ac.indicator_code
                 , unnest(translate(coalesce(ac.str_gender{lang}, ac.str_list{lang}), '[]', '{{}}')::text[]) gender
                 , ac.str_value{lang} as str_value
                 , unnest((case 
-                    when ac.str_value not like '[%%' then '{{'||trim(replace(ac.str_value{lang},',','|'))||'}}'  
+                    when ac.str_value not like '[%' then '{{'||trim(replace(ac.str_value{lang},',','|'))||'}}'  
                     else replace(replace(translate(ac.str_value{lang}, '[]', '{{}}') , ',}}','}}'),', }}', '}}')
                     end)::text[]) as value
             from external.answers_calc_agg ac 
             where 1=1
-                and ac.id_campaign ='{campaign}'
-                and ac.id_method ='{method}'
-                {orga}
-                {prj}
-                {net}
-            order by ac.path_order , indicator_code, gender
-        )
-        , res_full as (
-            select distinct ac.campaign_name{lang} as campaign_name, ac."year", id_campaign
-                , ac.id_method,  ac.method_name{lang} as method_name
-                , ac.method_section_title{lang} as method_section_title , ac.path_order 
-                , ac.id_indicator, ac.indicator_code , ac.indicator_name{lang} as indicator_name
-                , ac.is_direct_indicator , ac.indicator_category , ac.indicator_data_type 
-            from external.answers_calc_agg ac 
-            where 1=1
-                and ac.id_campaign ='{campaign}'
-                and ac.id_method ='{method}'
-        )
-         , org as (
-             select distinct ac.vat_number, ac.organization_name, ac.id_organization
-                 , id_project as id_project, coalesce(project_name,'') as project_name
-             from external.answers_calc_agg ac
-             where 1=1
-                and ac.id_campaign ='{campaign}'
-                and ac.id_method ='{method}'
+                and ac.id_campaign = :campaign
+                and ac.id_method = :method
+                and ac.id_indicator is not null
                 {orga}
                 {prj}
         )
-         select f.id_campaign, f.campaign_name, f."year"
-             , f.id_organization, r.vat_number, f.organization_name
-             , f.id_project as id_project, coalesce(f.project_name,'') as project_name
-             , f.id_method, f.method_name
-             , f.method_section_title, f.path_order
-             , f.id_indicator, f.indicator_code, f.indicator_name, f.is_direct_indicator, f.indicator_category, f.indicator_data_type
-             , str_value, gender
-             , coalesce(case when str_value like '["%%' and gender is null then value else gender end,'') as classificacio
-             , case when str_value like '["%%' and gender is null then '1' else value end as valor
-         from (select * 
-            from res_full f 
-                cross join org) f
-            left join res r on 
-                f.id_campaign = r.id_campaign  
-                    and f.id_method=r.id_method 
-                    and f.method_section_title = r.method_section_title 
-                    and f.id_indicator = r.id_indicator 
-                    and f.id_organization = r.id_organization 
-                    and (f.id_project = r.id_project or f.id_project is null and r.id_project is null)   
-         order by r.vat_number, f.path_order, f.is_direct_indicator, f.indicator_code
+        select id_campaign, id_method, id_organization, vat_number, organization_name, id_project, project_name
+            , id_indicator, str_value, gender
+            , coalesce(case when str_value like '["%' and gender is null then value else gender end,'') as classificacio
+            , case when str_value like '["%' and gender is null then '1' else value end as valor
+        from res
+        order by vat_number, path_order, is_direct_indicator, indicator_code
+    """
+    return query(qry, **params)
+
+
+EXPORT_COLUMNS = ('id_campaign', 'campaign_name', 'year', 'id_organization', 'vat_number', 'organization_name',
+                  'id_project', 'project_name', 'id_method', 'method_name', 'method_section_title', 'path_order',
+                  'id_indicator', 'indicator_code', 'indicator_name', 'is_direct_indicator', 'indicator_category',
+                  'indicator_data_type', 'str_value', 'gender', 'classificacio', 'valor')
+
+
+def get_catalog(db, campaign: str, method: str, indicators=()):
+    """Labels of a campaign and method in every language, from the in-process catalog cache.
+
+    A cached catalog lacking any of ``indicators`` predates their first answers and is loaded again.
+    """
+    cat = catalogs.get((campaign, method))
+    if cat is not None and cat.covers(indicators):
+        return cat
+    suffixes = [''] + [f"_{lang}" for lang in LANGUAGES]
+    translated = ", ".join(f"a.{f}{s}" for f in TRANSLATED for s in suffixes)
+    qry = f"""
+        select distinct on (a.id_indicator) a.id_indicator::text as id_indicator
+            , a.id_campaign::text as id_campaign, a."year", a.id_method::text as id_method
+            , coalesce(a.id_methods_section, 'e2ef801f-adbc-60d2-36d0-0b9f3516ebc7')::text as id_methods_section
+            , a.path_order, a.method_level, a.indicator_code, a.is_direct_indicator, a.indicator_category
+            , a.indicator_data_type, a.indicator_unit
+            , {translated}
+        from external.answers_calc_agg a
+        where a.id_campaign = :campaign
+            and a.id_method = :method
+            and a.id_indicator is not null
+        order by a.id_indicator, a.path_order
+    """
+    with metrics.stage('catalog'):
+        rows = statements.execute(db, query(qry, campaign=campaign, method=method)).fetchall()
+    cat = Catalog([row._mapping for row in rows], suffixes)
+    catalogs.put((campaign, method), cat)
+    return cat
+
+
+def get_campaign_methods(db, campaign: str):
+    """Ids of the methods with answers in a campaign."""
+    qry = """
+        select distinct a.id_method::text
+        from external.answers_calc_agg a
+        where a.id_campaign = :campaign
+            and a.id_indicator is not null
+        order by 1
+    """
+    return list(statements.execute(db, query(qry, campaign=campaign)).scalars())
+
+
+def iter_export_answers(db, campaign: str, method: str, organization: str = None, network: list = None,
+                        project: str = None, language: str = None, since: datetime.datetime = None,
+                        until: datetime.datetime = None):
+    """EXPORT_COLUMNS and a lazy iterator of the export rows, the labels joined from the catalog."""
+    cat = get_catalog(db, campaign, method)
+    lang = language_suffix(language)
+    qry = export_answers_query(campaign=campaign, method=method,
+                               organizations=scope_organizations(db, organization, network), project=project,
+                               language=language, since=since, until=until)
+    columns, rows = iter_query(db, qry)
+
+    def labelled():
+        nonlocal cat
+        checked = set()
+        for row in rows:
+            values = dict(zip(columns, row))
+            id_indicator = values['id_indicator']
+            if id_indicator not in cat.indicators and id_indicator not in checked:
+                checked.add(id_indicator)
+                cat = get_catalog(db, campaign, method, [id_indicator])
+            values = dict(cat.labels(id_indicator, lang), **values)
+            yield tuple(values.get(c) for c in EXPORT_COLUMNS)
+
+    return list(EXPORT_COLUMNS), labelled()
+
+
+def answers_scope(db, campaign: str, method: str, organization: str = None, network: list = None,
+                  project: str = None):
+    """Where clause and params over external.answers_calc_agg ``a`` of the scope of an answers export."""
+    params = dict(campaign=campaign, method=method)
+    where = "a.id_campaign = :campaign and a.id_method = :method"
+    where += organizations_filter('a.id_organization', scope_organizations(db, organization, network), params)
+    if project is not None and project != '':
+        where += " and a.id_project = :project"
+        params['project'] = project
+    return where, params
+
+
+def get_export_answers_high_water_mark(db, campaign: str, method: str, organization: str = None,
+                                       network: list = None, project: str = None):
+    """Latest survey update in the scope of an export, the bound of a delta and the ``since`` of the next one."""
+    where, params = answers_scope(db, campaign, method, organization=organization, network=network,
+                                  project=project)
+    qry = f"select max(a.survey_updated_at) from external.answers_calc_agg a where {where}"
+    return statements.execute(db, query(qry, **params)).scalar()
+
+
+def iter_export_answers_delta(db, campaign: str, method: str, since: datetime.datetime,
+                              until: datetime.datetime, organization: str = None, network: list = None,
+                              project: str = None, language: str = None):
+    """Records of the surveys updated after ``since`` and up to ``until``, the high water mark read first.
+
+    Every changed survey gets a ``tombstone`` with its current status, meaning the rows loaded for it before
+    are to be dropped, followed by the ``row`` records of the changed surveys, in the same shape as the
+    export, and a last ``high_water_mark`` record with ``until``. Surveys deleted outright leave no trace
+    in answers_calc_agg and can not be reported.
     """
+    if until is None or (since is not None and until <= since):
+        yield {'type': 'high_water_mark', 'high_water_mark': until}
+        return
 
-    cols = ['id_campaign', 'campaign_name', '"year"', 'id_organization', 'vat_number', 'organization_name']
-    cols.extend(['id_project', 'project_name'])
-    # if project is not None and project != '':
-    #     cols.extend(['id_project', 'project_name'])
-    cols.extend(['id_method', 'method_name', 'method_section_title'
-                    , 'path_order', 'id_indicator', 'indicator_code', 'indicator_name', 'is_direct_indicator',
-                 'indicator_category',
-                 'indicator_data_type', 'classificacio', 'valor'])
+    where, params = answers_scope(db, campaign, method, organization=organization, network=network,
+                                  project=project)
+    where += " and a.survey_updated_at <= :until"
+    params['until'] = until
+    if since is not None:
+        where += " and a.survey_updated_at > :since"
+        params['since'] = since
+    qry = f"""
+        select distinct a.id_survey, a.id_campaign, a.id_method, a.id_organization, a.id_project, a.status
+            , a.survey_updated_at
+        from external.answers_calc_agg a
+        where {where}
+        order by a.survey_updated_at, a.id_survey
+    """
+    with metrics.stage('sql'):
+        surveys = db.execute(query(qry, **params)).fetchall()
+    metrics.rows('sql', len(surveys))
+    for survey in surveys:
+        yield dict(survey._mapping, type='tombstone')
 
-    conn = db.bind
-    df = querytodataframe(qry, cols, conn)
+    columns, rows = iter_export_answers(db, campaign=campaign, method=method, organization=organization,
+                                       network=network, project=project, language=language, since=since,
+                                       until=until)
+    for row in rows:
+        yield dict(zip(columns, row), type='row')
+    yield {'type': 'high_water_mark', 'high_water_mark': until}
+
+
+def get_export_answers(db, campaign: str, method: str
+                       , organization: str = None
+                       , network: list = None
+                       , project: str = None,
+                       language: str = None,
+                       directory: str = '.'):
+    # the export stack is slow to import, it is only loaded once an export is actually built
+    import pandas as pd
+    from openpyxl.utils import get_column_letter
+    from .pivot import pivot_min
 
-    colsexcel = [df.vat_number, df.organization_name]
-    colsexcel.append(df.project_name)
-    # if project is not None and project != '':
-    #     colsexcel.append(df.project_name)
+    lang = language_suffix(language)
+    qry = export_answers_query(campaign=campaign, method=method,
+                               organizations=scope_organizations(db, organization, network), project=project,
+                               language=language)
+    with metrics.stage('sql'):
+        df = pd.read_sql(qry, db.connection())
+    metrics.rows('sql', len(df))
+    if df.empty:
+        raise HTTPException(status_code=404, detail="No answers found")
 
-    convert_dict = {'valor': str}
+    convert_dict = {'valor': str, 'id_indicator': str}
     df = df.astype(convert_dict)
+    # labels of every indicator are needed, the pivot drops rows left without them
+    cat = get_catalog(db, campaign, method, df['id_indicator'].unique())
+    labels = pd.DataFrame(cat.label_rows(lang), columns=['id_indicator', 'path_order', 'method_section_title',
+                                                         'method_name', 'is_direct_indicator', 'indicator_code',
+                                                         'indicator_name'])
+    df = df.merge(labels, on='id_indicator', how='left')
+    metrics.dataframe('sql', df)
 
-    ct = pd.crosstab(
-        index=[df.path_order, df.method_section_title, df.method_name, df.is_direct_indicator, df.indicator_code,
-               df.indicator_name, df.classificacio]
-        , columns=colsexcel, values=df.valor, aggfunc="min")
+    with metrics.stage('pivot'):
+        ct = pivot_min(df, index=['path_order', 'method_section_title', 'method_name', 'is_direct_indicator',
+                                  'indicator_code', 'indicator_name', 'classificacio']
+                       , columns=['vat_number', 'organization_name', 'project_name'], values='valor')
+    metrics.dataframe('pivot', ct)
 
-    # print(ct)
-    #
-    with pd.ExcelWriter(
-            f"export_{df.iloc[1]['campaign_name']}-{df.iloc[1]['method_name'].replace('/', '_')}.xlsx") as writer:
+    filename = f"export_{cat.name('campaign_name', lang)}-{cat.name('method_name', lang).replace('/', '_')}.xlsx"
+    path = os.path.join(directory, filename)
+    with metrics.stage('write'), pd.ExcelWriter(path) as writer:
         ct.to_excel(writer, sheet_name="Resultats")
         worksheet = writer.sheets['Resultats']
         worksheet.column_dimensions['A'].hidden = True
@@ -377,13 +940,18 @@ def get_export_answers(db, campaign: str, method: str
         for col in range(8, 4000):
             column_letter = get_column_letter(col)
             worksheet.column_dimensions[column_letter].width = 25
-        return f"export_{df.iloc[1]['campaign_name']}-{df.iloc[1]['method_name'].replace('/', '_')}.xlsx"
+    metrics.written('xlsx', os.path.getsize(path))
+    return filename
+
 
 
+def get_export_entities(db, region1: str = None, language: str = None, directory: str = '.'):
+    import pandas as pd
+    from openpyxl.utils import get_column_letter
 
-def get_export_entities(db, region1: str = None, language: str = None):
-    lang = ("_" + language) if language is not None else ""
-    reg1 = f" and sga.id='{region1}'" if region1 is not None else ""
+    lang = language_suffix(language)
+    reg1 = " and sga.id = :region1" if region1 is not None else ""
+    params = dict(region1=region1) if region1 is not None else {}
 
     qry = f"""
         select o.vat_number as "NIF", o."name" as "Nombre"
@@ -405,13 +973,14 @@ def get_export_entities(db, region1: str = None, language: str = None):
             {reg1} 
     """
 
-    cols = ['NIF', 'Nombre', 'email', 'ccaa', 'resultados_publicos', 'logo', 'forma_juridica_principal'
-        , 'forma_juridica_secundaria']
+    with metrics.stage('sql'):
+        df = pd.read_sql(query(qry, **params), db.connection())
+    metrics.rows('sql', len(df))
+    metrics.dataframe('sql', df)
 
-    conn = db.bind
-    df = querytodataframe(qry, cols, conn)
-
-    with pd.ExcelWriter(f"export_entidades_{df.iloc[1]['ccaa']}.xlsx") as writer:
+    filename = f"export_entidades_{df.iloc[1]['ccaa']}.xlsx"
+    path = os.path.join(directory, filename)
+    with metrics.stage('write'), pd.ExcelWriter(path) as writer:
         df.to_excel(writer, sheet_name="Resultats", index=False)
         worksheet = writer.sheets['Resultats']
         worksheet["E1"] = "Quiero hacer públicos los resultados"
@@ -428,48 +997,162 @@ def get_export_entities(db, region1: str = None, language: str = None):
         for col in range(8, 4000):
             column_letter = get_column_letter(col)
             worksheet.column_dimensions[column_letter].width = 25
-        return f"export_entidades_{df.iloc[1]['ccaa']}.xlsx"
+    metrics.written('xlsx', os.path.getsize(path))
+    return filename
 
 
-def get_export_entities_web(db, network_type: str = None, language: str = None):
-    lang = ("_" + language) if language is not None else ""
-    network = f" and network_type='{network_type}'" if network_type is not None else ""
+# (monotonic time it was computed, fingerprint) of get_entities_version
+_entities_version = (None, None)
 
-    qry = f"""
-        select o.vat_number as nif, o.name, o.description, o.website, o.address, o.longitude, o.latitude
-        , z.code  as zip
-        , u.email as email
-        , ci.name{lang} as town
-        , r2.name{lang} as province
-        , r1.name{lang} as autonomous_community
-        ,  ARRAY_AGG(distinct s.name{lang}) as sectors
-        , ARRAY_AGG(distinct n.name) as associations
-        , logo
-        , bs_allow_public
+
+def get_entities_version(db):
+    """Fingerprint of the organizations and their sectors, networks and users, the tables have no update stamp.
+
+    It hashes every row of those tables, so it is computed at most every ENTITIES_REFRESH_SECONDS and the
+    same value serves the ETags of /export-entities-web, the geo index and the entity export cache meanwhile.
+    """
+    global _entities_version
+    checked, version = _entities_version
+    now = time.monotonic()
+    if checked is not None and now - checked < ENTITIES_REFRESH_SECONDS:
+        return version
+    qry = """
+        select concat_ws('|'
+            , (select md5(string_agg(o::text, ',' order by o.id)) from syh_organizations_organization o)
+            , (select md5(string_agg(concat(so.organization_id, ':', so.sector_id), ',' order by so.organization_id, so.sector_id))
+               from syh_organizations_organization_sectors so)
+            , (select md5(string_agg(concat(no.organization_id, ':', no.network_id), ',' order by no.organization_id, no.network_id))
+               from syh_settings_network_organizations no)
+            , (select md5(string_agg(concat(up.organization_id, ':', u.email), ',' order by up.organization_id, u.email))
+               from syh_users_userprofile up join syh_users_user u on up.user_id = u.id)
+        ) as version
+    """
+    with metrics.stage('version'):
+        version = statements.execute(db, query(qry)).scalar()
+    _entities_version = (now, version)
+    return version
+
+
+def get_entity_points(db):
+    """Id, name and coordinates of the organizations listed on the map that have them, for geo.GeoIndex."""
+    qry = """
+        select o.id::text as id, o.name, o.longitude::float as longitude, o.latitude::float as latitude
         from syh_organizations_organization o
-        left join syh_organizations_organization_sectors so on so.organization_id = o.id 
-        left join syh_settings_sector s on so.sector_id = s.id 
-        left join syh_geodata_city ci on ci.id = o.city_id 
-        left join syh_geodata_region2 r2 on ci.region2_id  = r2.id
-        left join syh_geodata_zipcode z on o.zip_code_id = z.id 
-        join syh_users_userprofile up on up.organization_id=o.id
-        join syh_users_user u on up.user_id=u.id
-        left join syh_settings_network_organizations no on no.organization_id = o.id 
-        left join syh_settings_network n on n.id = no.network_id
-        left join syh_geodata_region1 r1 on o.region1_id  = r1.id
-        where 1=1
-            {network}
-        group by o.vat_number, o.name, o.description, o.website, o.address, o.longitude, o.latitude
-        , z.code  
-        , u.email 
-        , ci.name{lang} 
-        , r2.name{lang}
-        , r1.name{lang}
-        , logo
-        , bs_allow_public
+        where o.longitude is not null and o.latitude is not null
+            and exists (select 1 from syh_users_userprofile up join syh_users_user u on up.user_id = u.id
+                where up.organization_id = o.id)
     """
+    with metrics.stage('sql'):
+        rows = statements.execute(db, query(qry)).fetchall()
+    metrics.rows('sql', len(rows))
+    return [dict(row._mapping) for row in rows]
+
+
+# field -> (select expression, joins it needs) for get_export_entities_web
+ENTITY_FIELDS = {
+    'id': ('o.id', ()),
+    'nif': ('o.vat_number', ()),
+    'name': ('o.name', ()),
+    'description': ('o.description', ()),
+    'website': ('o.website', ()),
+    'address': ('o.address', ()),
+    'longitude': ('o.longitude', ()),
+    'latitude': ('o.latitude', ()),
+    'zip': ('z.code', ('z',)),
+    'email': ('u.email', ('u',)),
+    'town': ('ci.name{lang}', ('ci',)),
+    'province': ('r2.name{lang}', ('ci', 'r2')),
+    'autonomous_community': ('r1.name{lang}', ('r1',)),
+    # organizations without sectors or networks keep the [null] that array_agg over the left joins gave them
+    'sectors': ("""coalesce((select array_agg(distinct s.name{lang})
+                from syh_organizations_organization_sectors so
+                join syh_settings_sector s on so.sector_id = s.id
+                where so.organization_id = o.id), array[null]::text[])""", ()),
+    'associations': ("""coalesce((select array_agg(distinct n.name)
+                from syh_settings_network_organizations no
+                join syh_settings_network n on n.id = no.network_id
+                where no.organization_id = o.id {network}), array[null]::text[])""", ()),
+    'logo': ('o.logo', ()),
+    'bs_allow_public': ('o.bs_allow_public', ()),
+}
+ENTITY_JOINS = {
+    'z': "left join syh_geodata_zipcode z on o.zip_code_id = z.id",
+    'u': "join syh_users_userprofile up on up.organization_id = o.id join syh_users_user u on up.user_id = u.id",
+    'ci': "left join syh_geodata_city ci on ci.id = o.city_id",
+    'r2': "left join syh_geodata_region2 r2 on ci.region2_id = r2.id",
+    'r1': "left join syh_geodata_region1 r1 on o.region1_id = r1.id",
+}
+DEFAULT_ENTITY_FIELDS = [f for f in ENTITY_FIELDS if f != 'id']
+
+
+def get_export_entities_web(db, network_type: str = None, language: str = None, region1: str = None,
+                            sector: str = None, fields: list = None, after: str = None, limit: int = None):
+    """Organizations for the public map, as ``(entities, next_cursor)``.
+
+    Pages are keyed on the organization id: pass the returned cursor as ``after`` to get the next ``limit``
+    organizations, the cursor is None on the last page. ``fields`` restricts the columns, and with them
+    the joins and aggregates, that get computed.
+    """
+    lang = language_suffix(language)
+    fields = fields or DEFAULT_ENTITY_FIELDS
+    unknown = [f for f in fields if f not in ENTITY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    params = {k: v for k, v in dict(network_type=network_type, region1=region1, sector=sector, after=after,
+                                     limit=limit).items() if v is not None}
+    network = " and n.network_type = :network_type" if network_type is not None else ""
+    filters = ""
+    if network_type is not None:
+        filters += """
+            and exists (select 1
+                from syh_settings_network_organizations no
+                join syh_settings_network n on n.id = no.network_id
+                where no.organization_id = o.id and n.network_type = :network_type)"""
+    if region1 is not None:
+        filters += " and o.region1_id = :region1"
+    if sector is not None:
+        filters += """
+            and exists (select 1 from syh_organizations_organization_sectors so
+                where so.organization_id = o.id and so.sector_id = :sector)"""
+    if after is not None:
+        filters += " and o.id > :after"
+
+    joins = []
+    for field in fields:
+        joins.extend(j for j in ENTITY_FIELDS[field][1] if j not in joins)
+    if 'u' not in joins:
+        # only organizations with a user are listed, whether or not the email is asked for
+        filters += """
+            and exists (select 1 from syh_users_userprofile up join syh_users_user u on up.user_id = u.id
+                where up.organization_id = o.id)"""
+    columns = ["o.id as cursor"] + [f"{ENTITY_FIELDS[f][0].format(lang=lang, network=network)} as {f}" for f in fields]
+
+    qry = f"""
+        with page as (
+            select o.id
+            from syh_organizations_organization o
+            where 1=1
+                {filters}
+            order by o.id
+            {"limit :limit" if limit is not None else ""}
+        )
+        select {", ".join(columns)}
+        from page
+        join syh_organizations_organization o on o.id = page.id
+        {" ".join(ENTITY_JOINS[j] for j in ['z', 'u', 'ci', 'r2', 'r1'] if j in joins)}
+        order by o.id
+    """
+
+    clause = query(qry, **params)
+    with metrics.stage('sql'):
+        registries = statements.execute(db, clause) if fields is DEFAULT_ENTITY_FIELDS else db.execute(clause)
+        rows = registries.fetchall()
+    metrics.rows('sql', len(rows))
+    entities = [dict(zip(fields, t[1:])) for t in rows]
+    full_page = limit is not None and len({t[0] for t in rows}) == limit
+    return entities, (str(rows[-1][0]) if full_page else None)
+
 
-    registries = db.execute(text(qry))
-    columns = ['nif', 'name', 'description', 'website', 'address', 'longitude', 'latitude', 'zip', 'email', 'town',
-               'province', 'autonomous_community', 'sectors', 'associations', 'logo', 'bs_allow_public']
-    return [dict(zip(columns, t)) for t in registries]
+async def get_export_entities_web_async(db, **kwargs):
+    return await db.run_sync(get_export_entities_web, **kwargs)
@@ -2,22 +2,58 @@ import os
 
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from fastapi import Depends
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+from .config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE
 
 SQLALCHEMY_DATABASE_URL = os.environ.get('DBAPI', 'postgresql://tester@localhost/cedata_db_test')
-print(f"Setting up an engine to {SQLALCHEMY_DATABASE_URL}")
+if make_url(SQLALCHEMY_DATABASE_URL).drivername == 'postgresql':
+    # psycopg2 is the driver installed and the one statements.execute prepares for, whatever the SQLAlchemy
+    # version defaults to for a bare postgresql:// URL
+    SQLALCHEMY_DATABASE_URL = make_url(SQLALCHEMY_DATABASE_URL).set(
+        drivername='postgresql+psycopg2').render_as_string(False)
+ASYNC_DATABASE_URL = os.environ.get(
+    'ASYNC_DBAPI', make_url(SQLALCHEMY_DATABASE_URL).set(drivername='postgresql+asyncpg').render_as_string(False))
+
+pool_options = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=DB_POOL_PRE_PING,
+                    pool_recycle=DB_POOL_RECYCLE)
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL, poolclass=metrics.TimedQueuePool, **pool_options
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, poolclass=metrics.TimedAsyncQueuePool, **pool_options
+)
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession,
+                                 expire_on_commit=False)
+
+pools = {'sync': engine.pool, 'async': async_engine.pool}
+metrics.Gauge('syh_pool_checked_out', "Database connections currently checked out", ('pool',),
+              function=lambda pool: pools[pool].checkedout(), values=[(name,) for name in pools])
 
 Base = declarative_base()
 
 
+def offload(fn, *args, **kwargs):
+    """Call CPU bound ``fn`` on a worker thread when running under AsyncSession.run_sync, right away otherwise.
+
+    run_sync code runs on the event loop thread, so nesting or encoding a large result there would hold up
+    every other request until it is done.
+    """
+    if in_greenlet():
+        return await_only(run_in_threadpool(fn, *args, **kwargs))
+    return fn(*args, **kwargs)
+
+
 class CEDBContextManager:
     def __init__(self):
         self.db = SessionLocal()
@@ -27,3 +63,4 @@ class CEDBContextManager:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.db.close()
+
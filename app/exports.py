@@ -0,0 +1,61 @@
+import os
+
+from . import crud, metrics, networks
+from .cache import ExportCache
+from .config import EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_MAX_AGE
+
+cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_MAX_AGE)
+
+builders = {
+    'review-answers': crud.get_review_answers,
+    'export-answers': crud.get_export_answers,
+    'export-entities': crud.get_export_entities,
+}
+
+
+def data_version(db, kind: str, **params):
+    """Version of the data an export is built from.
+
+    Answer exports are versioned on the latest survey update of their campaign and method, so any change
+    in scope yields a new key, exports by network also on the network memberships and answer exports on the
+    catalog their labels come from. Entity exports are versioned on the organizations fingerprint.
+    """
+    if kind == 'export-entities':
+        return crud.get_entities_version(db)
+    version = crud.get_data_version(db, campaign=params['campaign'], method=params['method'],
+                                    organization=params.get('organization'), project=params.get('project'))
+    if params.get('network'):
+        version = f"{version}|{networks.current(db).version}"
+    if kind == 'export-answers':
+        version = f"{version}|{crud.get_catalog(db, params['campaign'], params['method']).version}"
+    return version
+
+
+def cache_key(kind: str, version: str, **params):
+    """Cache key of an export, the same whichever endpoint, job or bundle asks for it.
+
+    Unset parameters are left out and networks are hashed as a sorted list, so ``network='a'`` from an
+    export job and ``network=['a']`` from an endpoint share one artifact.
+    """
+    params = {name: value for name, value in params.items() if value not in (None, '', [])}
+    if 'network' in params:
+        network = params['network']
+        params['network'] = sorted([network] if isinstance(network, str) else network)
+    return cache.key(kind=kind, version=version, **params)
+
+
+def build(db, kind: str, **params):
+    """Return ``(path, filename)`` of the export, building it only if no current copy is cached."""
+    with metrics.stage('version'):
+        key = cache_key(kind, data_version(db, kind, **params), **params)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+
+    workdir = cache.workdir()
+    try:
+        filename = builders[kind](db, directory=workdir, **params)
+        path = cache.put(key, os.path.join(workdir, filename), filename)
+    finally:
+        cache.discard(workdir)
+    return path, filename
@@ -0,0 +1,105 @@
+"""In-process spatial index of the organizations on the map.
+
+Points are kept sorted by longitude, so a bounding box is two bisections plus a latitude filter over the
+slice in between. Below GEO_CLUSTER_MAX_ZOOM the points are grouped on a precomputed grid of web mercator
+tiles, GEO_CLUSTER_CELLS cells per tile side, and every zoom level gets its own sorted list of clusters
+(count and centroid), so a zoomed out map only walks the clusters in view.
+
+The index is rebuilt when the organizations fingerprint (crud.get_entities_version, itself recomputed at
+most every ENTITIES_REFRESH_SECONDS) changes. The new index is built aside and swapped in, so no lock is held while the
+database is queried.
+"""
+import bisect
+import math
+
+from . import crud
+from .database import offload
+from .config import GEO_CLUSTER_CELLS, GEO_CLUSTER_MAX_ZOOM
+
+MAX_LATITUDE = 85.05112878
+
+
+def parse_bbox(bbox: str):
+    """``west,south,east,north`` in degrees, a west greater than east crosses the antimeridian."""
+    try:
+        west, south, east, north = (float(v) for v in bbox.split(','))
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north in degrees")
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+        raise ValueError("bbox is out of range or has south above north")
+    return west, south, east, north
+
+
+def tile_xy(longitude: float, latitude: float):
+    """Web mercator position in [0, 1) of a point, x growing eastwards and y southwards."""
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    x = (longitude + 180) / 360
+    sin = math.sin(math.radians(latitude))
+    y = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return min(x, 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+
+class _Layer:
+    """Items (mappings with longitude and latitude) sorted by longitude."""
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: item['longitude'])
+        self.longitudes = [item['longitude'] for item in self.items]
+
+    def _between(self, west, east, south, north):
+        start = bisect.bisect_left(self.longitudes, west)
+        end = bisect.bisect_right(self.longitudes, east)
+        return [item for item in self.items[start:end] if south <= item['latitude'] <= north]
+
+    def within(self, west, south, east, north):
+        if west <= east:
+            return self._between(west, east, south, north)
+        return self._between(west, 180, south, north) + self._between(-180, east, south, north)
+
+
+def _clusters(points, zoom: int, cells: int):
+    side = (2 ** zoom) * cells
+    grid = {}
+    for point in points:
+        x, y = tile_xy(point['longitude'], point['latitude'])
+        cell = grid.setdefault((int(x * side), int(y * side)), [])
+        cell.append(point)
+    clusters = []
+    for members in grid.values():
+        if len(members) == 1:
+            clusters.append(members[0])
+            continue
+        clusters.append({'count': len(members),
+                         'longitude': sum(p['longitude'] for p in members) / len(members),
+                         'latitude': sum(p['latitude'] for p in members) / len(members)})
+    return clusters
+
+
+class GeoIndex:
+    def __init__(self, points, version: str = None, max_zoom: int = GEO_CLUSTER_MAX_ZOOM,
+                 cells: int = GEO_CLUSTER_CELLS):
+        self.version = version
+        self.max_zoom = max_zoom
+        self.points = _Layer(points)
+        self.zooms = [_Layer(_clusters(self.points.items, zoom, cells)) for zoom in range(max_zoom)]
+
+    def query(self, west: float, south: float, east: float, north: float, zoom: int):
+        """Organizations and clusters of more than one organization inside the box, as seen at ``zoom``."""
+        layer = self.points if zoom >= self.max_zoom else self.zooms[zoom]
+        found = layer.within(west, south, east, north)
+        return {'zoom': zoom,
+                'clusters': [item for item in found if 'count' in item],
+                'organizations': [item for item in found if 'count' not in item]}
+
+
+_index = None
+
+
+def current(db):
+    """The index of the organizations in ``db``, rebuilt first if they changed since it was built."""
+    global _index
+    version = crud.get_entities_version(db)
+    if _index is None or _index.version != version:
+        # clustering every zoom level is CPU bound, it is kept off the event loop under run_sync
+        _index = offload(GeoIndex, crud.get_entity_points(db), version)
+    return _index
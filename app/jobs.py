@@ -0,0 +1,240 @@
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+
+from . import exports, metrics
+from .config import EXPORT_JOB_WORKERS, EXPORT_JOB_DIR, EXPORT_JOB_TTL
+from .database import CEDBContextManager
+
+
+class Job:
+    """An export job, its state kept in ``<EXPORT_JOB_DIR>/<id>.json`` so every API process can report it."""
+
+    def __init__(self, kind: str, params: dict, id: str = None, created_at: datetime.datetime = None,
+                 started_at: datetime.datetime = None, finished_at: datetime.datetime = None, filename: str = None,
+                 path: str = None, error: str = None, host: str = None, pid: int = None):
+        self.id = id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.created_at = created_at or datetime.datetime.utcnow()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.filename = filename
+        self.path = path
+        self.error = error
+        # the process whose pool runs the job
+        self.host = host or socket.gethostname()
+        self.pid = pid or os.getpid()
+
+    @property
+    def status(self):
+        if self.finished_at is not None:
+            return 'failed' if self.error is not None else 'done'
+        if self.started_at is not None:
+            return 'running'
+        return 'queued'
+
+    def state(self):
+        state = dict(vars(self))
+        for field in ('created_at', 'started_at', 'finished_at'):
+            if state[field] is not None:
+                state[field] = state[field].isoformat()
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict):
+        for field in ('created_at', 'started_at', 'finished_at'):
+            if state.get(field) is not None:
+                state[field] = datetime.datetime.fromisoformat(state[field])
+        return cls(**state)
+
+    def lost(self):
+        """True for an unfinished job whose API process on this host is gone, it will never finish."""
+        if self.finished_at is not None or self.host != socket.gethostname():
+            return False
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+
+def _state_path(job_id: str):
+    return os.path.join(EXPORT_JOB_DIR, job_id + '.json')
+
+
+def save(job: Job):
+    os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+    path = _state_path(job.id)
+    # written aside and renamed, readers in other processes never see half a file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(job.state(), f, default=str)
+    os.replace(path + '.tmp', path)
+
+
+def load(job_id: str):
+    try:
+        with open(_state_path(job_id)) as f:
+            return Job.from_state(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def _all():
+    try:
+        names = os.listdir(EXPORT_JOB_DIR)
+    except FileNotFoundError:
+        return []
+    jobs = (load(name[:-len('.json')]) for name in names if name.endswith('.json'))
+    return [job for job in jobs if job is not None]
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor():
+    """Process pool shared by every background export, created on first use.
+
+    Workers are spawned rather than forked so none of them inherits the pooled database connections of
+    the API process.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=EXPORT_JOB_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def run_export(kind: str, params: dict, job_id: str = None):
+    """Build an export in a worker process, going through the shared export cache."""
+    if job_id is not None:
+        job = load(job_id)
+        if job is not None:
+            job.started_at = datetime.datetime.utcnow()
+            save(job)
+    with CEDBContextManager() as db:
+        try:
+            return exports.build(db, kind, **params)
+        except HTTPException as e:
+            # HTTPException does not survive unpickling in the parent process
+            raise RuntimeError(e.detail)
+
+
+def iter_bundle(campaign: str, methods, network: list = None, language: str = None):
+    """Build the export and review workbooks of every method at once, yielding ``(name, path)`` as each is done.
+
+    Every workbook goes through run_export on the process pool, so the bundle takes about as long as its
+    slowest method when there are enough EXPORT_JOB_WORKERS. Workbooks that could not be built are listed
+    in an ``errors.txt`` member, yielded last as bytes.
+    """
+    pool = executor()
+    futures = {}
+    for method in methods:
+        params = dict(campaign=campaign, method=method, network=network, language=language)
+        for kind, folder in (('export-answers', 'export'), ('review-answers', 'review')):
+            futures[pool.submit(run_export, kind, params)] = (folder, method)
+
+    errors = []
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            folder, method = futures[future]
+            try:
+                path, filename = future.result()
+            except Exception as e:
+                errors.append(f"{folder} {method}: {str(e) or e.__class__.__name__}")
+                continue
+            yield f"{folder}/{filename}", path
+    finally:
+        # the client went away, builds not started yet are dropped
+        for future in futures:
+            future.cancel()
+
+    if errors:
+        yield 'errors.txt', ('\n'.join(errors) + '\n').encode('utf-8')
+
+
+def _finished(job, future):
+    # the worker recorded when it started in the state file
+    job = load(job.id) or job
+    try:
+        path, filename = future.result()
+        os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+        job_path = os.path.join(EXPORT_JOB_DIR, job.id + os.path.splitext(path)[1])
+        # keep a copy of its own so cache eviction can not take the artifact away before it is downloaded
+        try:
+            os.link(path, job_path)
+        except OSError:
+            shutil.copyfile(path, job_path)
+        job.path, job.filename = job_path, filename
+    except Exception as e:
+        job.error = str(e) or e.__class__.__name__
+    job.finished_at = datetime.datetime.utcnow()
+    save(job)
+    # the worker processes keep their own registries, only the time the job took end to end is seen here
+    metrics.stage_seconds.observe((job.finished_at - job.created_at).total_seconds(), endpoint='/export-jobs',
+                                  stage=job.kind)
+
+
+def submit(kind: str, params: dict):
+    expire()
+    job = Job(kind, params)
+    save(job)
+    future = executor().submit(run_export, kind, params, job.id)
+    future.add_done_callback(lambda future: _finished(job, future))
+    return job
+
+
+def get(job_id: str):
+    """The job from its state file, whichever API process submitted it."""
+    expire()
+    job = load(job_id)
+    if job is not None and job.lost():
+        job.finished_at = datetime.datetime.utcnow()
+        job.error = "The API process running the job stopped, submit it again"
+        save(job)
+    return job
+
+
+def queue_position(job):
+    """Number of jobs submitted before ``job`` that are still waiting for a worker of the same process."""
+    if job.status != 'queued':
+        return None
+    waiting = [j for j in _all() if j.status == 'queued' and (j.host, j.pid) == (job.host, job.pid)
+               and j.created_at < job.created_at]
+    return len(waiting)
+
+
+def expire():
+    """Forget jobs finished more than EXPORT_JOB_TTL seconds ago and delete their files."""
+    limit = datetime.datetime.utcnow() - datetime.timedelta(seconds=EXPORT_JOB_TTL)
+    for job in _all():
+        if job.finished_at is None or job.finished_at >= limit:
+            continue
+        for path in (job.path, _state_path(job.id)):
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,236 @@
+"""In-process metrics in the Prometheus text format, served on /metrics.
+
+Every request runs inside ``MetricsMiddleware``, which remembers the matched route so the ``stage``
+timings and the sizes recorded deeper down (crud, exports) are labelled with the endpoint that caused
+them. Work done outside a request, like exports built in the job processes, is labelled ``none`` and only
+shows up in the registry of the process that did it.
+"""
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNTS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+BYTES = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)
+
+_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f'{self.name}{_labels(self.labels, key)} {value}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge that is either set, or read from ``function(**labels)`` for every label set in ``values``."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels=(), function=None, values=()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+        for value in values:
+            self._values[tuple(value)] = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self, key, value):
+        if self.function is not None:
+            value = self.function(**dict(zip(self.labels, key)))
+        return super()._samples(key, value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=SECONDS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_labels(self.labels, key, [("le", bound)])} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labels, key)} {counts[-1]}')
+        lines.append(f'{self.name}_count{_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+registry = []
+
+request_seconds = Histogram('syh_request_duration_seconds', "Time to serve a request, body included",
+                            ('endpoint', 'status'))
+stage_seconds = Histogram('syh_stage_duration_seconds', "Time spent in each stage of building a response",
+                          ('endpoint', 'stage'))
+rows_fetched = Histogram('syh_rows_fetched', "Rows fetched from the database per stage", ('endpoint', 'stage'),
+                         buckets=COUNTS)
+dataframe_bytes = Histogram('syh_dataframe_bytes', "Memory held by the DataFrames built for exports",
+                            ('endpoint', 'stage'), buckets=BYTES)
+bytes_written = Histogram('syh_bytes_written', "Bytes written per response or export file", ('endpoint', 'stage'),
+                          buckets=BYTES)
+pool_checkout_seconds = Histogram('syh_pool_checkout_seconds', "Wait for a database connection from the pool",
+                                  ('pool',))
+
+
+def endpoint():
+    """Route template of the request being served, ``none`` outside of one."""
+    scope = _request.get()
+    if scope is None:
+        return 'none'
+    route = scope.get('route')
+    return route.path if route is not None else 'unmatched'
+
+
+def stage(name: str):
+    """Context manager timing a stage of the current endpoint."""
+    return stage_seconds.time(endpoint=endpoint(), stage=name)
+
+
+def rows(stage: str, count: int):
+    rows_fetched.observe(count, endpoint=endpoint(), stage=stage)
+
+
+def dataframe(stage: str, df):
+    dataframe_bytes.observe(int(df.memory_usage(index=True, deep=True).sum()), endpoint=endpoint(), stage=stage)
+
+
+def written(stage: str, size: int):
+    bytes_written.observe(size, endpoint=endpoint(), stage=stage)
+
+
+def counted(iterable, stage: str):
+    """Pass ``iterable`` through, recording how many rows it yielded once it is exhausted or closed."""
+    count = 0
+    try:
+        for item in iterable:
+            count += 1
+            yield item
+    finally:
+        rows(stage, count)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long every checkout waited, as ``pool``."""
+    label = 'sync'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start, pool=self.label)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    label = 'async'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start, pool=self.label)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and counting the bytes of its response body."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        token = _request.set(scope)
+        start = time.perf_counter()
+        response = {'status': 500, 'bytes': 0}
+
+        async def send_measured(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['bytes'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            request_seconds.observe(time.perf_counter() - start, endpoint=endpoint(), status=response['status'])
+            written('response', response['bytes'])
+            _request.reset(token)
@@ -1,21 +1,8 @@
-import ast
-import uuid
 from datetime import datetime
-from sqlalchemy import Boolean, Column, Integer, String
-import requests
-from pandas import DataFrame
-import json
-import time
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String, Text, UniqueConstraint
 
 from .database import Base
 
-import os
-
-from dotenv import load_dotenv
-load_dotenv(dotenv_path='.env.devel', override=True)
-
-
-
 
 class ApiUser(Base):
     __tablename__ = "apiuser"
@@ -27,3 +14,49 @@ class ApiUser(Base):
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
 
+
+class AnswersDocument(Base):
+    """Precomputed /answers response for one organization, campaign, method, project and language."""
+    __tablename__ = "answers_document"
+    __table_args__ = (
+        UniqueConstraint('id_organization', 'id_campaign', 'id_method', 'id_project', 'language',
+                         'direct_indicators'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    id_organization = Column(String, nullable=False)
+    id_campaign = Column(String, nullable=False)
+    id_method = Column(String, nullable=False)
+    id_project = Column(String, nullable=False, default='')
+    language = Column(String, nullable=False, default='')
+    direct_indicators = Column(Boolean, nullable=False)
+    version = Column(String, nullable=False)
+    document = Column(Text, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+
+class AnswersRollup(Base):
+    """Distribution of the values of one indicator and gender among the organizations of a peer group."""
+    __tablename__ = "answers_rollup"
+    __table_args__ = (
+        UniqueConstraint('id_campaign', 'id_method', 'group_by', 'group_id', 'id_indicator', 'gender'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    id_campaign = Column(String, nullable=False)
+    id_method = Column(String, nullable=False)
+    group_by = Column(String, nullable=False)
+    group_id = Column(String, nullable=False, default='')
+    id_indicator = Column(String, nullable=False)
+    indicator_code = Column(String)
+    gender = Column(String, nullable=False, default='')
+    n = Column(Integer, nullable=False)
+    mean = Column(Float)
+    p10 = Column(Float)
+    p25 = Column(Float)
+    median = Column(Float)
+    p75 = Column(Float)
+    p90 = Column(Float)
+    version = Column(String, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,61 @@
+"""In-process index of the organizations of every network.
+
+Answer queries filtered by network get the member organizations from here as a list of ids instead of
+probing syh_settings_network_organizations for every answer row, and several networks can be combined.
+The index is rebuilt when the memberships fingerprint changes, checked at most every
+NETWORK_REFRESH_SECONDS; the new index is built aside and swapped in, as geo does.
+"""
+import time
+
+from sqlalchemy.sql import text
+
+from . import metrics, statements
+from .config import NETWORK_REFRESH_SECONDS
+
+VERSION_QUERY = """
+    select concat_ws('|', count(*)
+        , md5(string_agg(concat(no.network_id, ':', no.organization_id), ',' order by no.network_id, no.organization_id)))
+    from syh_settings_network_organizations no
+"""
+MEMBERS_QUERY = """
+    select no.network_id::text as network_id, no.organization_id::text as organization_id
+    from syh_settings_network_organizations no
+"""
+
+
+class NetworkIndex:
+    def __init__(self, rows, version: str = None):
+        self.version = version
+        members = {}
+        for network_id, organization_id in rows:
+            members.setdefault(str(network_id), set()).add(str(organization_id))
+        self.members = {network_id: frozenset(organizations) for network_id, organizations in members.items()}
+
+    def organizations(self, networks):
+        """Sorted ids of the organizations in any of ``networks``, empty for unknown networks."""
+        found = set()
+        for network_id in networks:
+            found |= self.members.get(str(network_id), frozenset())
+        return sorted(found)
+
+
+_index = None
+_checked = 0.0
+
+
+def current(db):
+    """The memberships index of ``db``, rebuilt first if they changed since it was built."""
+    global _index, _checked
+    now = time.monotonic()
+    if _index is not None and now - _checked < NETWORK_REFRESH_SECONDS:
+        return _index
+    version = statements.execute(db, text(VERSION_QUERY)).scalar()
+    if _index is None or _index.version != version:
+        with metrics.stage('networks'):
+            _index = NetworkIndex(statements.execute(db, text(MEMBERS_QUERY)).fetchall(), version)
+    _checked = now
+    return _index
+
+
+def organizations(db, networks):
+    return current(db).organizations(networks)
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+
+def pivot_min(df: pd.DataFrame, index: list, columns: list, values: str):
+    """Wide matrix of the minimum of ``values`` per ``index`` x ``columns`` combination.
+
+    Gives the same frame as ``pd.crosstab(index=..., columns=..., values=..., aggfunc="min")``: rows with a
+    missing key are dropped and both axes are sorted. Instead of grouping on every key level at once and
+    unstacking, each axis is numbered once with ``ngroup`` and the cells are filled straight into a numpy
+    matrix, so the cost grows linearly with the number of rows and organizations.
+    """
+    df = df.dropna(subset=index + columns)
+    empty_index = pd.MultiIndex.from_arrays([[] for _ in index], names=index)
+    empty_columns = pd.MultiIndex.from_arrays([[] for _ in columns], names=columns)
+    if df.empty:
+        return pd.DataFrame(index=empty_index, columns=empty_columns)
+
+    rows = df.groupby(index, sort=True).ngroup().to_numpy()
+    cols = df.groupby(columns, sort=True).ngroup().to_numpy()
+    nrows, ncols = rows.max() + 1, cols.max() + 1
+
+    # keep the first occurrence of every cell after sorting by value, i.e. its minimum
+    order = np.argsort(df[values].to_numpy(), kind='stable')
+    _, first = np.unique(rows[order] * ncols + cols[order], return_index=True)
+    cells = order[first]
+
+    matrix = np.full((nrows, ncols), np.nan, dtype=object)
+    matrix[rows[cells], cols[cells]] = df[values].to_numpy()[cells]
+
+    row_labels = np.unique(rows, return_index=True)[1]
+    col_labels = np.unique(cols, return_index=True)[1]
+    return pd.DataFrame(matrix,
+                        index=pd.MultiIndex.from_frame(df[index].iloc[row_labels]),
+                        columns=pd.MultiIndex.from_frame(df[columns].iloc[col_labels]))
@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .config import AUTH_CACHE_TTL, AUTH_CACHE_SIZE
+
+
+class PrincipalCache:
+    """Bounded LRU of token -> authenticated user, each entry living at most ``ttl`` seconds.
+
+    The token itself is still decoded and checked for expiry on every request; the cache only saves the
+    user lookup that follows. Entries are dropped per username whenever that user changes, in this process
+    only: other worker processes see the change once their entry expires, after at most ``ttl`` seconds, which
+is why AUTH_CACHE_TTL defaults to a few seconds.
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user):
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str = None):
+        """Forget every token of ``username``, or everything when no username is given."""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                return
+            for token in [t for t, (_, user) in self._entries.items() if user.username == username]:
+                del self._entries[token]
+
+
+principals = PrincipalCache(AUTH_CACHE_TTL, AUTH_CACHE_SIZE)
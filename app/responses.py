@@ -0,0 +1,112 @@
+"""Conditional requests and compression for the JSON data endpoints.
+
+Responses carry a weak ETag derived from the version of the data they were built from, so a client that
+sends it back in ``If-None-Match`` gets a bodiless 304 once the version query says nothing changed. Bodies
+are compressed with the first of HTTP_COMPRESSION the client accepts.
+"""
+import functools
+import gzip
+import hashlib
+import json
+
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+from .config import CACHE_CONTROL, HTTP_COMPRESSION, HTTP_COMPRESSION_LEVEL, HTTP_COMPRESSION_MIN_SIZE
+
+
+def etag(*parts):
+    """Weak ETag over the data version and whatever else selects the representation (the request params)."""
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def matches(if_none_match: str, tag: str):
+    """Weak comparison of ``tag`` against an If-None-Match header, as RFC 9110 asks for GET."""
+    if not if_none_match or tag is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = tag[2:] if tag.startswith('W/') else tag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+
+def cache_headers(tag: str = None):
+    headers = {'Cache-Control': CACHE_CONTROL}
+    if tag is not None:
+        headers['ETag'] = tag
+    if HTTP_COMPRESSION:
+        headers['Vary'] = 'Accept-Encoding'
+    return headers
+
+
+def not_modified(tag: str):
+    return Response(status_code=304, headers=cache_headers(tag))
+
+
+def json_response(content, tag: str = None, headers: dict = None):
+    """JSON body that is already serialized, with the caching headers of ``tag``."""
+    return Response(content=content, media_type='application/json', headers=dict(cache_headers(tag), **(headers or {})))
+
+
+@functools.lru_cache(maxsize=None)
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _encoders():
+    encoders = {'gzip': lambda body: gzip.compress(body, compresslevel=HTTP_COMPRESSION_LEVEL, mtime=0)}
+    if _brotli() is not None:
+        encoders['br'] = lambda body: _brotli().compress(body, quality=HTTP_COMPRESSION_LEVEL)
+    return encoders
+
+
+def negotiate(accept_encoding: str):
+    """First encoding of HTTP_COMPRESSION the client accepts, None to send the body as is."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    encoders = _encoders()
+    for encoding in HTTP_COMPRESSION:
+        if encoding in encoders and accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(response: Response, accept_encoding: str):
+    """Compress the body of a 200 ``response`` in place when it is large enough and the client accepts it."""
+    if response.status_code != 200 or 'content-encoding' in response.headers:
+        return response
+    if len(response.body) < HTTP_COMPRESSION_MIN_SIZE:
+        return response
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    response.body = _encoders()[encoding](response.body)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(response.body))
+    return response
+
+
+async def compress_async(response: Response, accept_encoding: str):
+    """compress from a coroutine, large bodies are compressed on a worker thread to keep the event loop free."""
+    if response.status_code != 200 or len(response.body) < HTTP_COMPRESSION_MIN_SIZE:
+        return response
+    return await run_in_threadpool(compress, response, accept_encoding)
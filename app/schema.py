@@ -0,0 +1,86 @@
+"""Schema management: alembic migrations (in migrations/) and the check of a deployed database.
+
+The API owns apiuser and answers_document, and the indexes its read paths rely on, some of which live on
+tables owned by others (external.answers_calc_agg, the syh_* tables). ``check`` reports what a database
+is missing compared to the latest migration, so a deploy can refuse to go on without them.
+"""
+import os
+
+from sqlalchemy import inspect, text
+
+from .database import engine
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alembic.ini')
+
+# (name, table, schema, key columns, included columns) the latest migration creates
+INDEXES = (
+    ('ix_answers_calc_agg_scope', 'answers_calc_agg', 'external',
+     ('id_organization', 'id_campaign', 'id_method', 'id_project', 'is_direct_indicator'), ()),
+    ('ix_answers_calc_agg_previous', 'answers_calc_agg', 'external',
+     ('id_organization', 'id_campaign', 'id_indicator'), ('previous_campaign_id', 'survey_updated_at')),
+    ('ix_answers_calc_agg_campaign', 'answers_calc_agg', 'external',
+     ('id_campaign', 'id_method', 'id_organization'), ()),
+    ('ix_network_organizations_member', 'syh_settings_network_organizations', None,
+     ('network_id', 'organization_id'), ()),
+)
+
+
+def alembic_config():
+    from alembic.config import Config
+    return Config(ALEMBIC_INI)
+
+
+def upgrade(revision: str = 'head'):
+    from alembic import command
+    command.upgrade(alembic_config(), revision)
+
+
+def pending_revision(connection):
+    """Head revision when the database is behind it, None when it is up to date."""
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    head = ScriptDirectory.from_config(alembic_config()).get_current_head()
+    current = MigrationContext.configure(connection).get_current_revision()
+    return head if current != head else None
+
+
+def missing_indexes(connection):
+    """Names of INDEXES with no valid index on the same columns, whatever it is called."""
+    inspector = inspect(connection)
+    invalid = set(connection.execute(text(
+        "select c.relname from pg_index i join pg_class c on c.oid = i.indexrelid where not i.indisvalid"
+    )).scalars())
+    missing = []
+    for name, table, schema, columns, include in INDEXES:
+        if not inspector.has_table(table, schema=schema):
+            missing.append(name)
+            continue
+        found = [ix for ix in inspector.get_indexes(table, schema=schema) if ix['name'] not in invalid
+                 and tuple(ix['column_names']) == columns
+                 and tuple(ix.get('dialect_options', {}).get('postgresql_include', ())) == include]
+        if not found:
+            missing.append(name)
+    return missing
+
+
+def index_ddl():
+    """``create index if not exists`` statements of INDEXES, for scratch databases filled outside the migrations."""
+    statements = []
+    for name, table, schema, columns, include in INDEXES:
+        qualified = f"{schema}.{table}" if schema else table
+        including = f" include ({', '.join(include)})" if include else ""
+        statements.append(f"create index if not exists {name} on {qualified} ({', '.join(columns)}){including}")
+    return statements
+
+
+def check():
+    """Problems of the database in DBAPI, an empty list when it is fully migrated."""
+    problems = []
+    with engine.connect() as connection:
+        head = pending_revision(connection)
+        if head is not None:
+            problems.append(f"database is not at migration {head}, run: python initialize.py schema")
+        for name in missing_indexes(connection):
+            problems.append(f"missing index {name}")
+    return problems
@@ -1,4 +1,5 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Optional, List, Union
 from pydantic import BaseModel
 
 
@@ -28,3 +29,25 @@ class ApiUser(ApiUserBase):
     class Config:
         orm_mode = True
 
+
+
+class ExportJobCreate(BaseModel):
+    kind: str
+    campaign: Optional[str] = None
+    method: Optional[str] = None
+    organization: Optional[str] = None
+    project: Optional[str] = None
+    network: Optional[Union[str, List[str]]] = None
+    region1: Optional[str] = None
+    language: Optional[str] = None
+
+
+class ExportJob(BaseModel):
+    id: str
+    kind: str
+    status: str
+    queue_position: Optional[int] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    filename: Optional[str] = None
+    error: Optional[str] = None
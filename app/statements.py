@@ -0,0 +1,46 @@
+import hashlib
+import re
+
+from sqlalchemy.sql import text
+
+_placeholder = re.compile(r'%\(([^)]+)\)s')
+
+
+def _prepare(compiled_sql: str):
+    """Turn a pyformat statement into a PREPARE body with $n placeholders, returning it and the param order.
+
+    The body is sent without parameters, so the ``%%`` pyformat escapes are turned back into ``%``.
+    """
+    names = []
+
+    def number(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _placeholder.sub(number, compiled_sql).replace('%%', '%'), names
+
+
+def execute(db, clause):
+    """Execute a bound text clause as a prepared statement of the session's current connection.
+
+    Every distinct SQL text is prepared once per pooled connection, under a name derived from its hash, and
+    run afterwards with ``EXECUTE``, so Postgres parses and plans it only once per connection. Statements
+    with expanding (list) parameters change shape with the list length and run unprepared, as does anything
+    on a driver other than psycopg2 (asyncpg keeps its own statement cache).
+    """
+    conn = db.connection()
+    compiled = clause.compile(dialect=conn.dialect)
+    if conn.dialect.driver != 'psycopg2' or any(b.expanding for b in compiled.binds.values()):
+        return db.execute(clause)
+
+    sql, names = _prepare(compiled.string)
+    name = 'syh_' + hashlib.sha1(sql.encode('utf-8')).hexdigest()[:20]
+    prepared = conn.connection.info.setdefault('prepared_statements', set())
+    if name not in prepared:
+        conn.exec_driver_sql(f"PREPARE {name} AS {sql}", execution_options={'no_parameters': True})
+        prepared.add(name)
+
+    arguments = f"({', '.join(':' + n for n in names)})" if names else ""
+    return db.execute(text(f"EXECUTE {name}{arguments}"), {n: compiled.params[n] for n in names})
@@ -0,0 +1,53 @@
+"""Assemble the nested /answers document from flat rows.
+
+Mirrors the nesting of the ``json_agg`` query in ``crud.get_answers``: campaign -> surveys -> methods ->
+method_section -> indicators -> results. Rows must be ordered by campaign, survey, method, section path,
+section, indicator code, indicator, gender and previous gender, so every level is built in a single pass.
+"""
+
+CAMPAIGN = ('id_campaign', 'campaign_name')
+SURVEY = ('id_survey', 'survey_created_at', 'survey_updated_at', 'status', 'id_organization', 'organization_name',
+          'vat_number', 'id_project', 'project_name')
+METHOD = ('id_method', 'method_name', 'method_description')
+SECTION = ('id_methods_section', 'method_section_title', 'path_order', 'method_level')
+INDICATOR = ('id_indicator', 'indicator_code', 'indicator_name', 'indicator_description', 'is_direct_indicator',
+             'indicator_category', 'indicator_data_type', 'indicator_unit')
+RESULT = ('gender', 'value', 'str_gender', 'str_list', 'str_value', 'prev_gender', 'prev_value', 'prev_str_gender',
+          'prev_str_value')
+
+# (fields, key fields, name of the list holding the children)
+LEVELS = (
+    (CAMPAIGN, ('id_campaign',), 'surveys'),
+    (SURVEY, ('id_survey',), 'methods'),
+    (METHOD, ('id_method',), 'method_section'),
+    (SECTION, ('id_methods_section',), 'indicators'),
+    (INDICATOR, ('id_indicator',), 'results'),
+)
+
+
+def build_answers(rows):
+    """Return the list of campaigns built from ``rows`` (mappings), or None when there are none."""
+    campaigns = []
+    keys = [None] * len(LEVELS)
+    nodes = [None] * len(LEVELS)
+    seen = set()
+    for row in rows:
+        parent = campaigns
+        changed = False
+        for depth, (fields, key_fields, children) in enumerate(LEVELS):
+            key = tuple(row[f] for f in key_fields)
+            if changed or key != keys[depth]:
+                changed = True
+                node = {f: row[f] for f in fields}
+                node[children] = []
+                parent.append(node)
+                keys[depth], nodes[depth] = key, node
+            parent = nodes[depth][LEVELS[depth][2]]
+        if changed:
+            seen = set()
+        result = tuple(row[f] for f in RESULT)
+        # results are distinct within their indicator
+        if result not in seen:
+            seen.add(result)
+            parent.append(dict(zip(RESULT, result)))
+    return campaigns or None
@@ -1,15 +1,27 @@
+import asyncio
 import random
 import string
+from concurrent.futures import ThreadPoolExecutor
 
 from passlib.context import CryptContext
 
+from .config import PASSWORD_HASH_WORKERS
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is deliberately slow, keep it on a few threads of its own so login bursts can not take over the rest
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -19,4 +31,3 @@ def get_random_string(length=6):
     letters = string.ascii_lowercase
     result_str = ''.join(random.choice(letters) for _ in range(length))
     return result_str
-
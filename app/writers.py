@@ -0,0 +1,192 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+import zipfile
+
+
+def _header(ws, columns):
+    """Header row with the same look pandas gives it in DataFrame.to_excel."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    thin = Side(style='thin')
+    cells = []
+    for column in columns:
+        cell = WriteOnlyCell(ws, value=column)
+        cell.font = Font(bold=True)
+        cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        cell.alignment = Alignment(horizontal='center', vertical='top')
+        cells.append(cell)
+    return cells
+
+
+def write_sheets(path: str, rows, sheet_of, columns):
+    """Write ``rows`` to an .xlsx with one worksheet per value of ``sheet_of(row)``.
+
+    Rows must arrive grouped by sheet. The workbook is opened in write-only mode, so every row is flushed
+    to disk as it is appended and memory stays flat regardless of the number of rows or sheets.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = None
+    current = None
+    for row in rows:
+        values = row._mapping
+        name = sheet_of(values)
+        if ws is None or name != current:
+            ws = wb.create_sheet(title=name)
+            ws.append(_header(ws, columns))
+            current = name
+        ws.append([values[c] for c in columns])
+    if ws is None:
+        wb.create_sheet()
+    wb.save(path)
+
+
+STREAM_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def iter_csv(columns, rows, batch_size: int = 1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(columns, rows, batch_size: int = 1000):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), default=json_default))
+        if len(lines) == batch_size:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _Sink:
+    """Write-only file object that hands back whatever has been written since the last drain."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(columns, rows, row_group_size: int = 50000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Sink()
+    writer = None
+    schema = None
+    strings = set()
+    for batch in _batches(rows, row_group_size):
+        data = {c: [row[i] for row in batch] for i, c in enumerate(columns)}
+        if writer is None:
+            schema = pa.Table.from_pydict(data).schema
+            # a column that is all nulls in the first group would be typed null for the whole file, it is
+            # written as strings instead, whatever its values turn out to be in the next groups
+            strings = {f.name for f in schema if pa.types.is_null(f.type)}
+            schema = pa.schema([f.with_type(pa.string()) if f.name in strings else f for f in schema])
+            writer = pq.ParquetWriter(sink, schema)
+        for c in strings:
+            data[c] = [None if v is None else str(v) for v in data[c]]
+        writer.write_table(pa.Table.from_pydict(data, schema=schema))
+        yield sink.drain()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, pa.schema([(c, pa.string()) for c in columns]))
+    writer.close()
+    yield sink.drain()
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_zip(files, chunk_size: int = 1024 * 1024):
+    """Stream a ZIP archive of ``files``, ``(name, path)`` pairs, writing each one as soon as it is yielded.
+
+    ``path`` may also be the bytes of a small member.
+
+    The archive goes to a _Sink, so every member carries a data descriptor instead of sizes patched in
+    afterwards. Members are stored as they are, the workbooks are zip files already.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path in files:
+            if isinstance(path, bytes):
+                archive.writestr(name, path)
+                yield sink.drain()
+                continue
+            info = zipfile.ZipInfo.from_file(path, arcname=name)
+            with open(path, 'rb') as source, archive.open(info, 'w') as member:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    member.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def encode(fmt: str, columns, rows):
+    """Serialize ``rows`` as a stream of byte chunks in one of STREAM_FORMATS."""
+    encoders = {'csv': iter_csv, 'ndjson': iter_ndjson, 'parquet': iter_parquet}
+    return encoders[fmt](columns, rows)
+
+
+def check_format(fmt: str):
+    """Raise ValueError for a format this installation can not stream."""
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(STREAM_FORMATS)}")
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet output needs pyarrow installed")
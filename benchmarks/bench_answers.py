@@ -0,0 +1,53 @@
+"""Compare the two /answers engines against the database in DBAPI.
+
+Builds the same document with the nested json_agg query and with the flat single language query plus
+tree.build_answers, checks they agree and prints the median latency and size of each.
+
+    python -m benchmarks.bench_answers ORGANIZATION CAMPAIGN METHOD [--language ca] [--repeat 5]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app import crud
+from app.database import CEDBContextManager
+
+ENGINES = ('json_agg', 'python')
+
+
+def run(db, engine: str, repeat: int, **params):
+    timings = []
+    document = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        document = crud.answers_document(db, engine=engine, **params)
+        timings.append(time.perf_counter() - start)
+    return document, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('organization')
+    parser.add_argument('campaign')
+    parser.add_argument('method')
+    parser.add_argument('--project')
+    parser.add_argument('--language')
+    parser.add_argument('--indirect', action='store_true', help="benchmark indirect indicators")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    params = dict(organization=args.organization, campaign=args.campaign, method=args.method,
+                  project=args.project, language=args.language, direct_indicators=not args.indirect)
+
+    documents = {}
+    print(f"{'engine':>10} {'median s':>9} {'bytes':>10}")
+    with CEDBContextManager() as db:
+        for engine in ENGINES:
+            document, seconds = run(db, engine, args.repeat, **params)
+            documents[engine] = json.loads(document)
+            print(f"{engine:>10} {seconds:>9.3f} {len(document.encode('utf-8')):>10}")
+    print("documents match" if documents['json_agg'] == documents['python'] else "documents DIFFER")
+
+
+if __name__ == "__main__":
+    main()
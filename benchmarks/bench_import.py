@@ -0,0 +1,58 @@
+"""Guard the import time of the API.
+
+Imports app.api in a fresh interpreter under ``-X importtime``, prints its cumulative import time and the
+slowest modules it pulled in, and exits non zero if it took longer than the budget or if any part of the
+export stack (pandas, numpy, openpyxl, pyarrow) got imported, as those must only load on first export.
+
+    python -m benchmarks.bench_import [--budget-ms 1500] [--runs 3]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+HEAVY = ('pandas', 'numpy', 'openpyxl', 'pyarrow')
+
+
+def import_profile():
+    code = "import sys, app.api; print(','.join(m for m in %r if m in sys.modules))" % (HEAVY,)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                          env=env, check=True)
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative) / 1000
+    heavy = [m for m in proc.stdout.strip().split(',') if m]
+    return timings, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=1500)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [import_profile() for _ in range(args.runs)]
+    best = min(runs, key=lambda run: run[0].get('app.api', 0))
+    timings, heavy = best
+    total = timings.get('app.api', 0)
+    print(f"app.api imported in {total:.0f} ms (best of {args.runs})")
+    top = sorted(((ms, name) for name, ms in timings.items() if '.' not in name), reverse=True)[:10]
+    for ms, name in top:
+        print(f"  {ms:>8.1f} ms  {name}")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: export stack imported eagerly: {', '.join(heavy)}")
+        failed = True
+    if total > args.budget_ms:
+        print(f"FAIL: over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare the export pivot against the pd.crosstab it replaced.
+
+Builds a synthetic long export frame (organizations x indicators x classifications), checks that both
+produce the same matrix and prints the time each takes as the number of organizations grows.
+
+    python -m benchmarks.bench_pivot [indicators] [organizations ...]
+"""
+import random
+import sys
+import time
+
+import pandas as pd
+
+from app.pivot import pivot_min
+
+INDEX = ['path_order', 'method_section_title', 'method_name', 'is_direct_indicator', 'indicator_code',
+         'indicator_name', 'classificacio']
+COLUMNS = ['vat_number', 'organization_name', 'project_name']
+
+
+def synthetic_export(organizations: int, indicators: int, seed: int = 0):
+    rnd = random.Random(seed)
+    rows = []
+    for o in range(organizations):
+        for i in range(indicators):
+            classifications = ['dona', 'home', 'no binari'] if i % 3 == 0 else ['']
+            for c in classifications:
+                if rnd.random() < 0.1:
+                    continue
+                rows.append({
+                    'path_order': f"{i // 20:02d}.{i % 20:02d}", 'method_section_title': f"Section {i // 20}",
+                    'method_name': 'Balanç Social', 'is_direct_indicator': i % 4 != 0,
+                    'indicator_code': f"IND{i:04d}", 'indicator_name': f"Indicator {i}", 'classificacio': c,
+                    'vat_number': f"B{o:08d}", 'organization_name': f"Organization {o}", 'project_name': '',
+                    'valor': str(rnd.randint(0, 1000)),
+                })
+    return pd.DataFrame(rows)
+
+
+def crosstab_min(df):
+    return pd.crosstab(index=[df[c] for c in INDEX], columns=[df[c] for c in COLUMNS], values=df.valor,
+                       aggfunc="min")
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(indicators=300, scales=(50, 200, 800)):
+    print(f"{'organizations':>13} {'rows':>9} {'crosstab s':>11} {'pivot_min s':>12} {'speedup':>8}")
+    for organizations in scales:
+        df = synthetic_export(organizations, indicators)
+        expected, t_crosstab = timed(crosstab_min, df)
+        result, t_pivot = timed(pivot_min, df, INDEX, COLUMNS, 'valor')
+        pd.testing.assert_frame_equal(expected, result, check_dtype=False, check_index_type=False,
+                                      check_column_type=False)
+        print(f"{organizations:>13} {len(df):>9} {t_crosstab:>11.3f} {t_pivot:>12.3f} {t_crosstab / t_pivot:>7.1f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    if args:
+        main(args[0], args[1:] or (50, 200, 800))
+    else:
+        main()
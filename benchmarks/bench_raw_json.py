@@ -0,0 +1,62 @@
+"""Compare the parsed and the raw text json_agg paths of /answers against the database in DBAPI.
+
+The parsed path lets psycopg2 load the aggregate into Python objects, walks them with jsonable_encoder and
+dumps them again; the raw path casts the aggregate to text and returns it untouched. Prints the median
+latency, the tracemalloc peak and the total of the allocations still held by each, and checks both
+documents hold the same JSON.
+
+    python -m benchmarks.bench_raw_json ORGANIZATION CAMPAIGN METHOD [--language ca] [--repeat 5]
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+from app import crud
+from app.database import CEDBContextManager
+
+PATHS = (('parsed', False), ('raw', True))
+
+
+def run(db, raw: bool, repeat: int, **params):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        document = crud.answers_document_json_agg(db, raw=raw, **params)
+        timings.append(time.perf_counter() - start)
+
+    # allocations are measured on a run of their own, tracing slows everything down
+    tracemalloc.start()
+    document = crud.answers_document_json_agg(db, raw=raw, **params)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return document, statistics.median(timings), peak, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('organization')
+    parser.add_argument('campaign')
+    parser.add_argument('method')
+    parser.add_argument('--project')
+    parser.add_argument('--language')
+    parser.add_argument('--indirect', action='store_true', help="benchmark indirect indicators")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    params = dict(organization=args.organization, campaign=args.campaign, method=args.method,
+                  project=args.project, language=args.language, direct_indicators=not args.indirect)
+
+    documents = {}
+    print(f"{'path':>8} {'median s':>9} {'peak KiB':>9} {'held KiB':>9} {'bytes':>10}")
+    with CEDBContextManager() as db:
+        for name, raw in PATHS:
+            document, seconds, peak, held = run(db, raw, args.repeat, **params)
+            documents[name] = json.loads(document)
+            print(f"{name:>8} {seconds:>9.3f} {peak / 1024:>9.0f} {held / 1024:>9.0f} "
+                  f"{len(document.encode('utf-8')):>10}")
+    print("documents match" if documents['parsed'] == documents['raw'] else "documents DIFFER")
+
+
+if __name__ == "__main__":
+    main()
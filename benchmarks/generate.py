@@ -0,0 +1,242 @@
+"""Fill the database in DBAPI with synthetic Show Your Heart data.
+
+Creates ``external.answers_calc_agg`` and the ``syh_*`` organization, network, sector, user and geodata
+tables the API reads, with only the columns it uses, and loads them with COPY. Every organization answers
+every campaign (minus a share of missing surveys), each campaign compares with the previous one, and the
+indicators come in the three shapes the exports tell apart: values by gender, plain values and multiple
+choice lists. Ids are uuid5 of readable names, so the same scale always gives the same ids.
+
+The tables are dropped first, point DBAPI at a scratch database.
+
+    python -m benchmarks.generate --organizations 200 --indicators 300 --campaigns 3 --yes
+"""
+import argparse
+import csv
+import datetime
+import io
+import random
+import uuid
+
+from app.database import engine
+from app.schema import index_ddl
+
+LANGUAGE_SUFFIXES = ('', '_en', '_ca', '_es', '_eu', '_gl', '_nl', '_fr')
+GENDERS = ('Dona', 'Home', 'No binari')
+CHOICES = ('Opció A', 'Opció B', 'Opció C', 'Opció D')
+SECTION_SIZE = 20
+
+
+def ident(kind: str, *parts):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"syh-bench/{kind}/{'/'.join(map(str, parts))}"))
+
+
+def translated(name: str):
+    return ', '.join(f"{name}{suffix} text" for suffix in LANGUAGE_SUFFIXES)
+
+
+def translations(value):
+    return [None if value is None else f"{value} ({suffix[1:]})" if suffix else value for suffix in LANGUAGE_SUFFIXES]
+
+
+def untranslated(value):
+    """Same value in every language, for the JSON shaped str_* columns the exports parse."""
+    return [value] * len(LANGUAGE_SUFFIXES)
+
+
+SCHEMA = f"""
+    drop table if exists external.answers_calc_agg;
+    drop table if exists syh_users_userprofile, syh_users_user, syh_settings_network_organizations,
+        syh_settings_network, syh_organizations_organization_sectors, syh_settings_sector,
+        syh_organizations_organization, syh_settings_legalstructure, syh_geodata_zipcode, syh_geodata_city,
+        syh_geodata_region2, syh_geodata_region1;
+    create schema if not exists external;
+
+    create table syh_geodata_region1 (id uuid primary key, {translated('name')});
+    create table syh_geodata_region2 (id uuid primary key, region1_id uuid, {translated('name')});
+    create table syh_geodata_city (id uuid primary key, region2_id uuid, {translated('name')});
+    create table syh_geodata_zipcode (id uuid primary key, code text);
+    create table syh_settings_legalstructure (id uuid primary key, parent_id uuid, {translated('name')});
+    create table syh_organizations_organization (
+        id uuid primary key, vat_number text, name text, description text, website text, address text,
+        longitude double precision, latitude double precision, zip_code_id uuid, city_id uuid, region1_id uuid,
+        legal_structure_id uuid, logo text, bs_allow_public boolean);
+    create table syh_settings_sector (id uuid primary key, {translated('name')});
+    create table syh_organizations_organization_sectors (
+        id serial primary key, organization_id uuid, sector_id uuid);
+    create table syh_settings_network (id uuid primary key, name text, network_type text);
+    create table syh_settings_network_organizations (
+        id serial primary key, network_id uuid, organization_id uuid);
+    create table syh_users_user (id uuid primary key, email text);
+    create table syh_users_userprofile (id serial primary key, user_id uuid, organization_id uuid);
+
+    create table external.answers_calc_agg (
+        id_campaign uuid, {translated('campaign_name')}, "year" integer, previous_campaign_id uuid,
+        id_survey uuid, survey_created_at timestamptz, survey_updated_at timestamptz, status text,
+        id_method uuid, {translated('method_name')}, {translated('method_description')},
+        id_user uuid, user_name text, user_surname text, user_email text,
+        id_organization uuid, organization_name text, vat_number text,
+        id_methods_section uuid, {translated('method_section_title')},
+        method_order integer, method_level integer, path_order text, sort_value integer,
+        id_indicator uuid, indicator_code text, {translated('indicator_name')},
+        {translated('indicator_description')},
+        is_direct_indicator boolean, indicator_category text, indicator_data_type text, indicator_unit text,
+        {translated('gender')}, value numeric, num_gender integer,
+        {translated('str_gender')}, {translated('str_list')}, {translated('str_value')},
+        id_project uuid, project_name text
+    );
+"""
+
+
+def copy(cursor, table: str, rows):
+    """COPY ``rows`` into ``table`` in chunks, returns how many were loaded."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    total = 0
+
+    def flush():
+        buffer.seek(0)
+        cursor.copy_expert(f"copy {table} from stdin with (format csv)", buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        writer.writerow(['' if v is None else v for v in row])
+        total += 1
+        if total % 50000 == 0:
+            flush()
+    flush()
+    return total
+
+
+def geodata(regions: int):
+    region1 = [[ident('region1', r)] + translations(f"Region {r}") for r in range(regions)]
+    region2 = [[ident('region2', r), ident('region1', r)] + translations(f"Province {r}") for r in range(regions)]
+    cities = [[ident('city', r, c), ident('region2', r)] + translations(f"Town {r}.{c}")
+              for r in range(regions) for c in range(10)]
+    return region1, region2, cities
+
+
+def organizations(rnd, count: int, regions: int, sectors: int, networks: int):
+    orgs, org_sectors, members, users, profiles = [], [], [], [], []
+    for o in range(count):
+        region = rnd.randrange(regions)
+        org_id = ident('organization', o)
+        orgs.append([org_id, f"B{o:08d}", f"Organization {o}", f"Description of organization {o}",
+                     f"https://org{o}.example.org", f"Street {o}", round(rnd.uniform(-9.3, 3.3), 6),
+                     round(rnd.uniform(36.0, 43.8), 6), ident('zipcode', o % 500), ident('city', region, o % 10),
+                     ident('region1', region), ident('legalstructure', o % 6), f"logos/{o}.png",
+                     rnd.random() < 0.7])
+        for s in rnd.sample(range(sectors), rnd.randint(0, min(3, sectors))):
+            org_sectors.append([org_id, ident('sector', s)])
+        for n in rnd.sample(range(networks), rnd.randint(0, min(2, networks))):
+            members.append([ident('network', n), org_id])
+        users.append([ident('user', o), f"user{o}@org{o}.example.org"])
+        profiles.append([ident('user', o), org_id])
+    return orgs, org_sectors, members, users, profiles
+
+
+def indicator_results(rnd, i: int):
+    """``(gender, value, num_gender, str_gender, str_list, str_value)`` rows of one indicator answer."""
+    if i % 3 == 0:
+        values = [rnd.randint(0, 50) for _ in GENDERS]
+        return [(g, v, len(GENDERS), f'["{g}"]', None, f'[{v}]') for g, v in zip(GENDERS, values)]
+    if i % 3 == 1:
+        v = rnd.randint(0, 1000)
+        return [(None, v, None, None, '[""]', str(v))]
+    chosen = sorted(rnd.sample(CHOICES, rnd.randint(1, len(CHOICES))))
+    return [(None, len(chosen), None, None, '[' + ', '.join(f'"{c}"' for c in CHOICES) + ']',
+             '[' + ', '.join(f'"{c}"' for c in chosen) + ']')]
+
+
+def answers(rnd, orgs, indicators: int, campaigns: int, methods: int, missing: float):
+    start = datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc)
+    for c in range(campaigns):
+        campaign_id = ident('campaign', c)
+        previous = ident('campaign', c - 1) if c else None
+        for m in range(methods):
+            method_id = ident('method', m)
+            for o, org in enumerate(orgs):
+                if rnd.random() < missing:
+                    continue
+                survey_id = ident('survey', c, m, o)
+                created = start + datetime.timedelta(days=365 * c + rnd.randint(0, 90))
+                updated = created + datetime.timedelta(days=rnd.randint(0, 60), seconds=rnd.randint(0, 86400))
+                for i in range(indicators):
+                    section = i // SECTION_SIZE
+                    for gender, value, num_gender, str_gender, str_list, str_value in indicator_results(rnd, i):
+                        yield ([campaign_id] + translations(f"Campaign {2018 + c}") + [2018 + c, previous,
+                               survey_id, created, updated, 'finished', method_id]
+                               + translations(f"Method {m}") + translations(f"Method {m} description")
+                               + [ident('user', o), f"Name {o}", f"Surname {o}", org[1].lower() + '@example.org',
+                                  org[0], org[2], org[1], ident('section', m, section)]
+                               + translations(f"Section {section}")
+                               + [m, 1, f"{section:02d}", i, ident('indicator', m, i),
+                                  f"IND{i:04d}"]
+                               + translations(f"Indicator {i}") + translations(f"Indicator {i} description")
+                               + [i % 4 != 0, f"Category {i % 7}", ('numeric', 'numeric', 'list')[i % 3],
+                                  'persones' if i % 3 == 0 else None]
+                               + translations(gender) + [value, num_gender] + untranslated(str_gender)
+                               + untranslated(str_list) + untranslated(str_value) + [None, None])
+
+
+def generate(organizations_count: int = 200, indicators: int = 300, campaigns: int = 3, methods: int = 1,
+             regions: int = 17, sectors: int = 20, networks: int = 10, missing: float = 0.1, seed: int = 0):
+    """Recreate and fill the tables, returns the ids and row counts a benchmark needs."""
+    rnd = random.Random(seed)
+    region1, region2, cities = geodata(regions)
+    orgs, org_sectors, members, users, profiles = organizations(rnd, organizations_count, regions, sectors, networks)
+
+    counts = {}
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA)
+        counts['region1'] = copy(cursor, 'syh_geodata_region1', region1)
+        copy(cursor, 'syh_geodata_region2', region2)
+        copy(cursor, 'syh_geodata_city', cities)
+        copy(cursor, 'syh_geodata_zipcode', [[ident('zipcode', z), f"{z:05d}"] for z in range(500)])
+        copy(cursor, 'syh_settings_legalstructure',
+             [[ident('legalstructure', s), ident('legalstructure', s % 2) if s >= 2 else None]
+              + translations(f"Legal structure {s}") for s in range(6)])
+        counts['organizations'] = copy(cursor, 'syh_organizations_organization', orgs)
+        copy(cursor, 'syh_settings_sector', [[ident('sector', s)] + translations(f"Sector {s}") for s in range(sectors)])
+        copy(cursor, 'syh_organizations_organization_sectors (organization_id, sector_id)', org_sectors)
+        copy(cursor, 'syh_settings_network',
+             [[ident('network', n), f"Network {n}", ('territorial', 'sectorial')[n % 2]] for n in range(networks)])
+        copy(cursor, 'syh_settings_network_organizations (network_id, organization_id)', members)
+        copy(cursor, 'syh_users_user', users)
+        copy(cursor, 'syh_users_userprofile (user_id, organization_id)', profiles)
+        counts['answers'] = copy(cursor, 'external.answers_calc_agg',
+                                 answers(rnd, orgs, indicators, campaigns, methods, missing))
+        # the indexes a migrated database has, dropped along the tables
+        for ddl in index_ddl():
+            cursor.execute(ddl)
+        cursor.execute("analyze")
+        conn.commit()
+    finally:
+        conn.close()
+
+    return dict(counts, campaign=ident('campaign', campaigns - 1), method=ident('method', 0),
+                organization=orgs[0][0], network=ident('network', 0), network_type='territorial',
+                region1=ident('region1', 0), sector=ident('sector', 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--organizations', type=int, default=200)
+    parser.add_argument('--indicators', type=int, default=300)
+    parser.add_argument('--campaigns', type=int, default=3)
+    parser.add_argument('--methods', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--yes', action='store_true', help="confirm the tables in DBAPI may be dropped")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error(f"this drops and recreates the data tables in {engine.url!r}, pass --yes to go ahead")
+
+    result = generate(args.organizations, args.indicators, args.campaigns, args.methods, seed=args.seed)
+    for key, value in result.items():
+        print(f"{key:>14} {value}")
+
+
+if __name__ == "__main__":
+    main()
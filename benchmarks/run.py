@@ -0,0 +1,109 @@
+"""Time the data endpoints end to end on synthetic data of growing size.
+
+For every number of organizations given, regenerates the tables in DBAPI with benchmarks.generate and runs
+the crud function behind each data endpoint, printing its median latency, the tracemalloc peak of one
+traced run and the size of what it produced (response body or .xlsx file). ``get_answers`` is timed
+twice, building the document (``cold``) and serving the stored one (``stored``).
+
+The tables are dropped first, point DBAPI at a scratch database.
+
+    python -m benchmarks.run --organizations 50 200 800 --indicators 300 --campaigns 3 --yes
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from app import crud, models, schema
+from app.database import CEDBContextManager
+
+from .generate import generate
+
+
+def answers(db, scale, stored: bool):
+    if not stored:
+        db.query(models.AnswersDocument).delete()
+        db.commit()
+    response = crud.get_answers(db, organization=scale['organization'], campaign=scale['campaign'],
+                                method=scale['method'])
+    return len(response.body)
+
+
+def review_answers(db, scale, directory):
+    filename = crud.get_review_answers(db, campaign=scale['campaign'], method=scale['method'], directory=directory)
+    return os.path.getsize(os.path.join(directory, filename))
+
+
+def export_answers(db, scale, directory):
+    filename = crud.get_export_answers(db, campaign=scale['campaign'], method=scale['method'], directory=directory)
+    return os.path.getsize(os.path.join(directory, filename))
+
+
+def export_entities(db, scale, directory):
+    filename = crud.get_export_entities(db, directory=directory)
+    return os.path.getsize(os.path.join(directory, filename))
+
+
+def export_entities_web(db, scale):
+    entities, _ = crud.get_export_entities_web(db)
+    return len(json.dumps(entities, default=str).encode('utf-8'))
+
+
+def cases(directory):
+    return [
+        ('get_answers cold', lambda db, scale: answers(db, scale, stored=False)),
+        ('get_answers stored', lambda db, scale: answers(db, scale, stored=True)),
+        ('get_review_answers', lambda db, scale: review_answers(db, scale, directory)),
+        ('get_export_answers', lambda db, scale: export_answers(db, scale, directory)),
+        ('get_export_entities', lambda db, scale: export_entities(db, scale, directory)),
+        ('get_export_entities_web', export_entities_web),
+    ]
+
+
+def measure(fn, db, scale, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = fn(db, scale)
+        timings.append(time.perf_counter() - start)
+
+    # allocations are measured on a run of their own, tracing slows everything down
+    tracemalloc.start()
+    fn(db, scale)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--organizations', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--indicators', type=int, default=300)
+    parser.add_argument('--campaigns', type=int, default=3)
+    parser.add_argument('--methods', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--yes', action='store_true', help="confirm the tables in DBAPI may be dropped")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this drops and recreates the data tables in DBAPI, pass --yes to go ahead")
+
+    print(f"{'organizations':>13} {'answers rows':>12} {'function':<24} {'median s':>9} {'peak MiB':>9} "
+          f"{'output KiB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for organizations in args.organizations:
+            scale = generate(organizations, args.indicators, args.campaigns, args.methods, seed=args.seed)
+            # the API tables, the indexes were created along the data
+            schema.upgrade()
+            with CEDBContextManager() as db:
+                for name, fn in cases(directory):
+                    seconds, peak, size = measure(fn, db, scale, args.repeat)
+                    print(f"{organizations:>13} {scale['answers']:>12} {name:<24} {seconds:>9.3f} "
+                          f"{peak / 1024 ** 2:>9.1f} {size / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 
 import sys
-from app import crud, database, schemas
+from app import crud, database, schema, schemas
 
 
 def create_user(username, email, password):
@@ -11,6 +11,17 @@ def create_user(username, email, password):
 
 
 if __name__ == "__main__":
+    # python initialize.py schema                      migrate the tables and indexes of the API to the latest version
+    # python initialize.py check                       exit non zero if the database is not fully migrated
+    # python initialize.py <username> <email> <password>  create an API user
+    if sys.argv[1:] == ['schema']:
+        schema.upgrade()
+        sys.exit()
+    if sys.argv[1:] == ['check']:
+        problems = schema.check()
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1 if problems else 0)
     try:
         create_user(sys.argv[1], sys.argv[2], sys.argv[3])
     except:
@@ -0,0 +1,42 @@
+from alembic import context
+
+from app import models  # noqa: F401, registers the tables on Base
+from app.database import Base, engine
+
+target_metadata = Base.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # the database also holds the tables of the main application and external.*, autogenerate must only
+    # look at the ones declared in app.models
+    if type_ == 'table' and reflected and compare_to is None:
+        return False
+    return True
+
+
+def run_migrations_offline():
+    context.configure(url=engine.url.render_as_string(hide_password=False), target_metadata=target_metadata,
+                      include_object=include_object, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = context.config.attributes.get('connection')
+    if connection is not None:
+        _run(connection)
+        return
+    with engine.connect() as connection:
+        _run(connection)
+
+
+def _run(connection):
+    context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,55 @@
+"""API tables: apiuser and answers_document
+
+Databases set up with the old create_all already have them, those are adopted as they are.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'apiuser' not in existing:
+        op.create_table(
+            'apiuser',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('email', sa.String(), nullable=True),
+            sa.Column('username', sa.String(), nullable=False),
+            sa.Column('fullname', sa.String(), nullable=True),
+            sa.Column('hashed_password', sa.String(), nullable=False),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.UniqueConstraint('username'),
+        )
+        op.create_index('ix_apiuser_id', 'apiuser', ['id'])
+        op.create_index('ix_apiuser_email', 'apiuser', ['email'], unique=True)
+    if 'answers_document' not in existing:
+        op.create_table(
+            'answers_document',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('id_organization', sa.String(), nullable=False),
+            sa.Column('id_campaign', sa.String(), nullable=False),
+            sa.Column('id_method', sa.String(), nullable=False),
+            sa.Column('id_project', sa.String(), nullable=False),
+            sa.Column('language', sa.String(), nullable=False),
+            sa.Column('direct_indicators', sa.Boolean(), nullable=False),
+            sa.Column('version', sa.String(), nullable=False),
+            sa.Column('document', sa.Text(), nullable=False),
+            sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+            sa.UniqueConstraint('id_organization', 'id_campaign', 'id_method', 'id_project', 'language',
+                                'direct_indicators'),
+        )
+
+
+def downgrade():
+    op.drop_table('answers_document')
+    op.drop_index('ix_apiuser_email', table_name='apiuser')
+    op.drop_index('ix_apiuser_id', table_name='apiuser')
+    op.drop_table('apiuser')
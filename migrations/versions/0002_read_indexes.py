@@ -0,0 +1,44 @@
+"""Indexes of the read paths on external.answers_calc_agg and the network memberships
+
+- answers scope: the organization, campaign, method, project and direct indicator filter of /answers
+- previous campaign: the self join on (organization, previous campaign -> campaign, indicator), covering
+  previous_campaign_id and survey_updated_at so the answers versions are read from the index alone
+- campaign: the campaign wide review and export queries and their data version
+- network members: the EXISTS probe of the network filters
+
+Built concurrently, so the tables stay writable while this runs on a deployed database.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_answers_calc_agg_scope', 'answers_calc_agg', 'external',
+     ['id_organization', 'id_campaign', 'id_method', 'id_project', 'is_direct_indicator'], []),
+    ('ix_answers_calc_agg_previous', 'answers_calc_agg', 'external',
+     ['id_organization', 'id_campaign', 'id_indicator'], ['previous_campaign_id', 'survey_updated_at']),
+    ('ix_answers_calc_agg_campaign', 'answers_calc_agg', 'external',
+     ['id_campaign', 'id_method', 'id_organization'], []),
+    ('ix_network_organizations_member', 'syh_settings_network_organizations', None,
+     ['network_id', 'organization_id'], []),
+)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, schema, columns, include in INDEXES:
+            op.create_index(name, table, columns, schema=schema, postgresql_include=include,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, schema, columns, include in INDEXES:
+            op.drop_index(name, table_name=table, schema=schema, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,41 @@
+"""answers_rollup: precomputed value distributions per indicator, gender and peer group
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'answers_rollup',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('id_campaign', sa.String(), nullable=False),
+        sa.Column('id_method', sa.String(), nullable=False),
+        sa.Column('group_by', sa.String(), nullable=False),
+        sa.Column('group_id', sa.String(), nullable=False),
+        sa.Column('id_indicator', sa.String(), nullable=False),
+        sa.Column('indicator_code', sa.String(), nullable=True),
+        sa.Column('gender', sa.String(), nullable=False),
+        sa.Column('n', sa.Integer(), nullable=False),
+        sa.Column('mean', sa.Float(), nullable=True),
+        sa.Column('p10', sa.Float(), nullable=True),
+        sa.Column('p25', sa.Float(), nullable=True),
+        sa.Column('median', sa.Float(), nullable=True),
+        sa.Column('p75', sa.Float(), nullable=True),
+        sa.Column('p90', sa.Float(), nullable=True),
+        sa.Column('version', sa.String(), nullable=False),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('id_campaign', 'id_method', 'group_by', 'group_id', 'id_indicator', 'gender'),
+    )
+
+
+def downgrade():
+    op.drop_table('answers_rollup')
@@ -0,0 +1,8 @@
+
+from app import crud, database
+
+
+if __name__ == "__main__":
+    with database.CEDBContextManager() as db:
+        print(f"{crud.refresh_answer_documents(db)} answer documents refreshed")
+        print(f"{crud.refresh_answer_rollups(db)} answer rollups refreshed")
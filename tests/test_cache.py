@@ -0,0 +1,71 @@
+import os
+import time
+
+from app.cache import ExportCache
+
+
+def build(cache, key, size: int, filename: str = 'export.xlsx'):
+    workdir = cache.workdir()
+    source = os.path.join(workdir, filename)
+    with open(source, 'wb') as f:
+        f.write(b'x' * size)
+    try:
+        return cache.put(key, source, filename)
+    finally:
+        cache.discard(workdir)
+
+
+def test_key_ignores_the_order_of_parts():
+    assert ExportCache.key(a=1, b=[2]) == ExportCache.key(b=[2], a=1)
+    assert ExportCache.key(a=1) != ExportCache.key(a=2)
+
+
+def test_put_then_get(tmp_path):
+    cache = ExportCache(str(tmp_path), max_bytes=1000, max_age=60)
+    path = build(cache, 'k', 10, 'report.xlsx')
+    assert cache.get('k') == (path, 'report.xlsx')
+    assert cache.get('missing') is None
+    assert [p for p in os.listdir(tmp_path) if p.startswith('build-')] == []
+
+
+def test_evicts_least_recently_used_over_max_bytes(tmp_path):
+    cache = ExportCache(str(tmp_path), max_bytes=25, max_age=60)
+    old = build(cache, 'old', 10)
+    recent = build(cache, 'recent', 10)
+    past = time.time() - 100
+    os.utime(old, (past, past))
+    os.utime(recent, (past + 50, past + 50))
+    # a hit makes the old artifact the most recently used one
+    cache.get('old')
+    build(cache, 'new', 10)
+    assert cache.get('old') is not None
+    assert cache.get('recent') is None
+    assert cache.get('new') is not None
+
+
+def test_keeps_the_new_artifact_even_over_max_bytes(tmp_path):
+    cache = ExportCache(str(tmp_path), max_bytes=5, max_age=60)
+    build(cache, 'big', 10)
+    assert cache.get('big') is not None
+
+
+def test_expired_artifacts_are_missed_and_evicted(tmp_path):
+    cache = ExportCache(str(tmp_path), max_bytes=1000, max_age=0)
+    path = build(cache, 'k', 10)
+    time.sleep(0.01)
+    assert cache.get('k') is None
+    cache.evict()
+    assert not os.path.exists(path)
+
+
+def test_export_key_is_shared_by_endpoints_jobs_and_bundles():
+    from app.exports import cache_key
+
+    bundle = dict(campaign='c', method='m', network=['b', 'a'], language='es')
+    endpoint = dict(campaign='c', method='m', organization=None, project=None, network=['a', 'b'], language='es')
+    assert cache_key('export-answers', 'v1', **bundle) == cache_key('export-answers', 'v1', **endpoint)
+
+    job = dict(campaign='c', method='m', organization=None, project=None, network='a', language=None)
+    endpoint = dict(campaign='c', method='m', organization=None, project=None, network=['a'], language=None)
+    assert cache_key('review-answers', 'v1', **job) == cache_key('review-answers', 'v1', **endpoint)
+    assert cache_key('review-answers', 'v1', **job) != cache_key('review-answers', 'v2', **job)
@@ -0,0 +1,49 @@
+import pytest
+
+from app.geo import GeoIndex, parse_bbox, tile_xy
+
+
+def point(id, longitude, latitude):
+    return {'id': id, 'longitude': longitude, 'latitude': latitude}
+
+
+POINTS = [point('barcelona', 2.17, 41.39), point('girona', 2.82, 41.98), point('fiji', 179.5, -17.7),
+          point('samoa', -171.8, -13.8)]
+
+
+def ids(found):
+    return sorted(item['id'] for item in found['organizations'])
+
+
+def test_parse_bbox():
+    assert parse_bbox('1,2,3,4') == (1.0, 2.0, 3.0, 4.0)
+    for bbox in ('1,2,3', 'a,b,c,d', '0,10,1,5', '0,0,200,1'):
+        with pytest.raises(ValueError):
+            parse_bbox(bbox)
+
+
+def test_tile_xy():
+    assert tile_xy(0, 0) == pytest.approx((0.5, 0.5))
+    x, y = tile_xy(-180, 90)
+    assert x == 0 and y == 0
+
+
+def test_points_inside_a_box():
+    index = GeoIndex(POINTS, max_zoom=4)
+    assert ids(index.query(2, 41, 3, 42, zoom=10)) == ['barcelona', 'girona']
+    assert ids(index.query(2.5, 41, 3, 42, zoom=10)) == ['girona']
+
+
+def test_box_across_the_antimeridian():
+    index = GeoIndex(POINTS, max_zoom=4)
+    assert ids(index.query(170, -20, -170, -10, zoom=10)) == ['fiji', 'samoa']
+    assert ids(index.query(-170, -20, 170, -10, zoom=10)) == []
+
+
+def test_clusters_below_max_zoom():
+    index = GeoIndex(POINTS, max_zoom=4, cells=4)
+    found = index.query(-180, -85, 180, 85, zoom=0)
+    assert [c['count'] for c in found['clusters']] == [2]
+    assert ids(found) == ['fiji', 'samoa']
+    found = index.query(-180, -85, 180, 85, zoom=4)
+    assert found['clusters'] == [] and len(found['organizations']) == 4
@@ -0,0 +1,58 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from app.pivot import pivot_min
+
+INDEX = ['path_order', 'indicator_code', 'classificacio']
+COLUMNS = ['vat_number', 'organization_name']
+
+
+def export_frame(organizations: int = 6, indicators: int = 12, seed: int = 0):
+    rnd = random.Random(seed)
+    rows = []
+    for o in range(organizations):
+        for i in range(indicators):
+            for c in (['dona', 'home'] if i % 3 == 0 else ['']):
+                if rnd.random() < 0.2:
+                    continue
+                rows.append({'path_order': f"{i // 4:02d}", 'indicator_code': f"IND{i:03d}", 'classificacio': c,
+                             'vat_number': f"B{o:03d}", 'organization_name': f"Organization {o}",
+                             'valor': str(rnd.randint(0, 50))})
+    return pd.DataFrame(rows)
+
+
+def crosstab_min(df):
+    return pd.crosstab(index=[df[c] for c in INDEX], columns=[df[c] for c in COLUMNS], values=df.valor,
+                       aggfunc="min")
+
+
+def assert_same(expected, result):
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False, check_index_type=False,
+                                  check_column_type=False)
+
+
+def test_matches_crosstab():
+    df = export_frame()
+    assert_same(crosstab_min(df), pivot_min(df, INDEX, COLUMNS, 'valor'))
+
+
+def test_keeps_the_minimum_of_duplicate_cells():
+    df = export_frame(2, 3)
+    df = pd.concat([df, df.assign(valor='0')], ignore_index=True)
+    result = pivot_min(df, INDEX, COLUMNS, 'valor')
+    assert_same(crosstab_min(df), result)
+    assert set(v for v in result.to_numpy().ravel() if isinstance(v, str)) == {'0'}
+
+
+def test_drops_rows_with_missing_keys():
+    df = export_frame(2, 3)
+    df.loc[0, 'vat_number'] = np.nan
+    assert_same(crosstab_min(df), pivot_min(df, INDEX, COLUMNS, 'valor'))
+
+
+def test_empty_frame():
+    result = pivot_min(export_frame().iloc[:0], INDEX, COLUMNS, 'valor')
+    assert result.empty
+    assert list(result.index.names) == INDEX and list(result.columns.names) == COLUMNS
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+from app.principals import PrincipalCache
+
+
+def user(name):
+    return SimpleNamespace(username=name)
+
+
+def test_get_put():
+    cache = PrincipalCache(ttl=60, max_size=10)
+    assert cache.get('token') is None
+    cache.put('token', user('anna'))
+    assert cache.get('token').username == 'anna'
+
+
+def test_entries_expire():
+    cache = PrincipalCache(ttl=-1, max_size=10)
+    cache.put('token', user('anna'))
+    assert cache.get('token') is None
+
+
+def test_least_recently_used_is_dropped_over_max_size():
+    cache = PrincipalCache(ttl=60, max_size=2)
+    cache.put('a', user('anna'))
+    cache.put('b', user('bernat'))
+    cache.get('a')
+    cache.put('c', user('carla'))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_invalidate_by_username():
+    cache = PrincipalCache(ttl=60, max_size=10)
+    cache.put('a1', user('anna'))
+    cache.put('a2', user('anna'))
+    cache.put('b', user('bernat'))
+    cache.invalidate('anna')
+    assert cache.get('a1') is None and cache.get('a2') is None
+    assert cache.get('b') is not None
+    cache.invalidate()
+    assert cache.get('b') is None
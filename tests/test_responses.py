@@ -0,0 +1,40 @@
+import gzip
+
+from app import responses
+
+
+def test_etag_depends_on_every_part():
+    tag = responses.etag('answers', {'id': 1}, 'v1')
+    assert tag.startswith('W/"') and tag.endswith('"')
+    assert tag == responses.etag('answers', {'id': 1}, 'v1')
+    assert tag != responses.etag('answers', {'id': 1}, 'v2')
+
+
+def test_matches():
+    tag = 'W/"abc"'
+    assert responses.matches('W/"abc"', tag)
+    assert responses.matches('"abc"', tag)
+    assert responses.matches('"other", W/"abc"', tag)
+    assert responses.matches('*', tag)
+    assert not responses.matches('"other"', tag)
+    assert not responses.matches(None, tag)
+    assert not responses.matches('*', None)
+
+
+def test_negotiate():
+    assert responses.negotiate(None) is None
+    assert responses.negotiate('gzip, deflate') == 'gzip'
+    assert responses.negotiate('gzip;q=0') is None
+    assert responses.negotiate('*') in ('br', 'gzip')
+    assert responses.negotiate('identity') is None
+
+
+def test_compress_only_large_enough_bodies():
+    small = responses.compress(responses.json_response('{}'), 'gzip')
+    assert 'content-encoding' not in small.headers
+
+    body = '{"a":"' + 'x' * responses.HTTP_COMPRESSION_MIN_SIZE + '"}'
+    large = responses.compress(responses.json_response(body), 'gzip')
+    assert large.headers['content-encoding'] == 'gzip'
+    assert gzip.decompress(large.body).decode('utf-8') == body
+    assert large.headers['content-length'] == str(len(large.body))
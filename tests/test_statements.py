@@ -0,0 +1,34 @@
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.sql import text
+
+from app.statements import _prepare
+
+
+def test_placeholders_are_numbered_in_order():
+    sql, names = _prepare("select * from t where a = %(campaign)s and b = %(method)s")
+    assert sql == "select * from t where a = $1 and b = $2"
+    assert names == ['campaign', 'method']
+
+
+def test_repeated_names_reuse_their_number():
+    sql, names = _prepare("select %(a)s, %(b)s, %(a)s")
+    assert sql == "select $1, $2, $1"
+    assert names == ['a', 'b']
+
+
+def test_escaped_percents_are_unescaped():
+    sql, names = _prepare("select 100 %% 7, %(a)s")
+    assert sql == "select 100 % 7, $1"
+    assert names == ['a']
+
+
+def test_like_literals_survive_compilation():
+    clause = text("select * from t where code like '[%' and name like :name")
+    compiled = clause.compile(dialect=psycopg2.dialect())
+    sql, names = _prepare(compiled.string)
+    assert sql == "select * from t where code like '[%' and name like $1"
+    assert names == ['name']
+
+
+def test_no_parameters():
+    assert _prepare("select 1") == ("select 1", [])
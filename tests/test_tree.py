@@ -0,0 +1,39 @@
+from app.tree import CAMPAIGN, INDICATOR, METHOD, RESULT, SECTION, SURVEY, build_answers
+
+
+def row(section: int, indicator: int, gender: str = None, **values):
+    fields = dict.fromkeys(CAMPAIGN + SURVEY + METHOD + SECTION + INDICATOR + RESULT)
+    fields.update(id_campaign='c', id_survey='s', id_method='m', id_methods_section=f"section{section}",
+                  path_order=f"{section:02d}", id_indicator=f"i{indicator}", indicator_code=f"IND{indicator}",
+                  gender=gender)
+    fields.update(values)
+    return fields
+
+
+def test_no_rows():
+    assert build_answers([]) is None
+
+
+def test_nests_every_level_once():
+    rows = [row(0, 0, 'dona', value=1), row(0, 0, 'home', value=2), row(0, 1), row(1, 2)]
+    [campaign] = build_answers(rows)
+    [survey] = campaign['surveys']
+    [method] = survey['methods']
+    sections = method['method_section']
+    assert [s['id_methods_section'] for s in sections] == ['section0', 'section1']
+    assert [i['id_indicator'] for i in sections[0]['indicators']] == ['i0', 'i1']
+    assert [r['value'] for r in sections[0]['indicators'][0]['results']] == [1, 2]
+    assert set(sections[0]['indicators'][0]['results'][0]) == set(RESULT)
+
+
+def test_results_are_distinct_within_their_indicator():
+    rows = [row(0, 0, 'dona', value=1), row(0, 0, 'dona', value=1), row(0, 1, 'dona', value=1)]
+    indicators = build_answers(rows)[0]['surveys'][0]['methods'][0]['method_section'][0]['indicators']
+    assert [len(i['results']) for i in indicators] == [1, 1]
+
+
+def test_a_new_parent_starts_new_children():
+    rows = [row(0, 0), row(0, 0, id_survey='t')]
+    surveys = build_answers(rows)[0]['surveys']
+    assert [s['id_survey'] for s in surveys] == ['s', 't']
+    assert all(len(s['methods'][0]['method_section'][0]['indicators']) == 1 for s in surveys)
@@ -0,0 +1,29 @@
+import io
+import zipfile
+
+from app import writers
+
+
+def test_iter_zip(tmp_path):
+    path = tmp_path / 'export.xlsx'
+    content = bytes(range(256)) * 1000
+    path.write_bytes(content)
+    chunks = list(writers.iter_zip([('export/export.xlsx', str(path)), ('errors.txt', b'review m: failed\n')],
+                                   chunk_size=4096))
+    assert len(chunks) > 2
+
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.testzip() is None
+    assert archive.namelist() == ['export/export.xlsx', 'errors.txt']
+    assert archive.read('export/export.xlsx') == content
+    assert archive.read('errors.txt') == b'review m: failed\n'
+
+
+def test_iter_zip_without_members():
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(writers.iter_zip([]))))
+    assert archive.namelist() == []
+
+
+def test_iter_csv():
+    data = b''.join(writers.iter_csv(['a', 'b'], iter([(1, 'x'), (2, None)]), batch_size=1)).decode('utf-8')
+    assert data.splitlines() == ['a,b', '1,x', '2,']